@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of reference grammars built only from parsec4 combinators.
+
+Each grammar parses a generated input of each size, and the throughput,
+the time per character, the allocations and the peak RSS are reported.
+The results can be saved as a JSON baseline, and a later run compared
+with it:
+
+    python benchmarks/reference.py --sizes 1K,1M --save baseline.json
+    python benchmarks/reference.py --sizes 1K,1M --compare baseline.json
+
+A comparison exits with status 1 if any grammar has become slower, in
+time per character, by more than the threshold (10% by default), and
+with status 2, comparing nothing, if the baseline was made with other
+options or on another Python or machine.
+
+Each grammar and size is measured in a fresh process, so that the peak
+RSS is that of one measurement.
+"""
+
+import argparse
+import concurrent.futures
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+from   time import perf_counter
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parsec4 import *
+
+
+##########################################################################
+# The grammars. Each function returns a parser of a whole input.
+##########################################################################
+
+def json_grammar() -> Parser:
+    """
+    JSON, with strings by charseq() and numbers by IEEE754.
+    """
+    token = lambda s: lexeme(string(s))
+    json_string = (quote >> many(charseq()) << quote).parsecmap(''.join)
+
+    @fix
+    def value(value:Parser) -> Parser:
+        pair = lexeme(json_string) + (token(':') >> value)
+        obj = (token('{') >> sepBy(pair, token(',')) << token('}')).parsecmap(dict)
+        array = token('[') >> sepBy(value, token(',')) << token(']')
+        return ( obj
+            | array
+            | lexeme(json_string)
+            | lexeme(IEEE754).parsecmap(float)
+            | token('true').result(True)
+            | token('false').result(False)
+            | token('null').result(None) )
+
+    return WHITESPACE >> value
+
+
+def csv_grammar() -> Parser:
+    """
+    Comma separated records, one per line, with quoted or bare fields.
+    """
+    field = (quote >> many(charseq()) << quote).parsecmap(''.join) | regex(r'[^,"\n]*')
+    record = sepBy1(field, string(','))
+    return many(record << string('\n'))
+
+
+def arithmetic_grammar() -> Parser:
+    """
+    Expressions of numbers, + - * / and parentheses, by way of fix().
+    """
+    token = lambda s: lexeme(string(s))
+
+    @fix
+    def expr(expr:Parser) -> Parser:
+        atom = number() | (token('(') >> expr << token(')'))
+        term = atom + many((token('*') | token('/')) + atom)
+        return term + many((token('+') | token('-')) + term)
+
+    return many(expr << token(';'))
+
+
+def syslog_grammar() -> Parser:
+    """
+    Lines of a timestamp, an IPv4 address, a program[pid]: and a message.
+    """
+    @generate
+    def line() -> tuple:
+        when = yield lexeme(TIMESTAMP)
+        host = yield lexeme(IPv4_ADDR)
+        program = yield regex(r'[a-z]+')
+        pid = yield (string('[') >> regex(r'[0-9]+') << string(']:')).parsecmap(int)
+        message = yield regex(r' [^\n]*\n')
+        raise EndOfGenerator((when, host, program, pid, message[1:-1]))
+
+    return many(line)
+
+
+def quoted_grammar() -> Parser:
+    """
+    Quoted strings with escapes, separated by white space.
+    """
+    return WHITESPACE >> many(quoted)
+
+
+##########################################################################
+# The inputs. Each generator returns a text of at least `size` characters
+# made of whole records, and is repeatable for a given seed.
+##########################################################################
+
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'error', 'session', 'opened',
+    'closed', 'user', 'root', 'for', 'from', 'port', 'ssh2', 'accepted')
+
+def _fill(size:int, record:Callable, seed:int) -> str:
+    rng = random.Random(seed)
+    parts, n = [], 0
+    while n < size:
+        part = record(rng)
+        parts.append(part)
+        n += len(part)
+    return ''.join(parts)
+
+
+def _json_value(rng:random.Random, depth:int) -> str:
+    kind = rng.randrange(8 if depth < 4 else 5)
+    if kind == 0:
+        return str(rng.randint(-10**6, 10**6))
+    if kind == 1:
+        return repr(rng.uniform(-1e3, 1e3))
+    if kind == 2:
+        return '"' + ' '.join(rng.choices(WORDS, k=rng.randint(1, 4))) + '\\n"'
+    if kind == 3:
+        return rng.choice(('true', 'false', 'null'))
+    if kind == 4:
+        return '"' + rng.choice(WORDS) + '"'
+    if kind in (5, 6):
+        items = (f'"{rng.choice(WORDS)}{i}": {_json_value(rng, depth + 1)}'
+            for i in range(rng.randint(0, 5)))
+        return '{' + ', '.join(items) + '}'
+    return '[' + ', '.join(_json_value(rng, depth + 1) for _ in range(rng.randint(0, 5))) + ']'
+
+
+def json_input(size:int, seed:int) -> str:
+    items = _fill(size, lambda rng: _json_value(rng, 1) + ',\n', seed)
+    return '[\n' + items + '1\n]\n'
+
+
+def csv_input(size:int, seed:int) -> str:
+    def record(rng:random.Random) -> str:
+        return ','.join(
+            f'"{rng.choice(WORDS)}, {rng.choice(WORDS)}"' if rng.random() < 0.2 else
+            str(rng.randint(0, 99999)) if rng.random() < 0.5 else rng.choice(WORDS)
+            for _ in range(rng.randint(3, 8))) + '\n'
+    return _fill(size, record, seed)
+
+
+def arithmetic_input(size:int, seed:int) -> str:
+    def expr(rng:random.Random, depth:int) -> str:
+        terms = []
+        for _ in range(rng.randint(1, 4)):
+            if depth < 3 and rng.random() < 0.3:
+                terms.append('(' + expr(rng, depth + 1) + ')')
+            else:
+                terms.append(str(rng.randint(0, 999)) if rng.random() < 0.7 else f'{rng.uniform(0, 99):.3f}')
+            terms.append(rng.choice(' + | - | * | / '.split('|')))
+        return ''.join(terms[:-1])
+    return _fill(size, lambda rng: expr(rng, 0) + ';\n', seed)
+
+
+def syslog_input(size:int, seed:int) -> str:
+    def line(rng:random.Random) -> str:
+        return (f'2024/{rng.randint(1, 12)}/{rng.randint(1, 28)} '
+            f'{rng.randint(0, 23):02}:{rng.randint(0, 59):02}:{rng.randint(0, 59):02} '
+            f'{rng.randint(1, 254)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)} '
+            f'{rng.choice(("sshd", "cron", "kernel", "systemd"))}[{rng.randint(1, 65535)}]: '
+            + ' '.join(rng.choices(WORDS, k=rng.randint(3, 12))) + '\n')
+    return _fill(size, line, seed)
+
+
+def quoted_input(size:int, seed:int) -> str:
+    def item(rng:random.Random) -> str:
+        body = ' '.join(rng.choices(WORDS, k=rng.randint(1, 6)))
+        if rng.random() < 0.3:
+            body += rng.choice(('\\"', '\\\\', '\\n', '\\t', '\\u00e9'))
+        return f'"{body}" ' if rng.random() < 0.9 else f'"{body}"\n'
+    return _fill(size, item, seed)
+
+
+REFERENCE = {
+    'json': (json_grammar, json_input),
+    'csv': (csv_grammar, csv_input),
+    'arithmetic': (arithmetic_grammar, arithmetic_input),
+    'syslog': (syslog_grammar, syslog_input),
+    'quoted': (quoted_grammar, quoted_input),
+    }
+
+
+##########################################################################
+# Measurement.
+##########################################################################
+
+def parse_size(s:str) -> int:
+    """
+    '64K' -> 65536, and so on for M and G.
+    """
+    s = s.strip().upper()
+    scale = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}.get(s[-1:], 1)
+    return int(float(s[:-1] if scale > 1 else s) * scale)
+
+
+def peak_rss() -> int:
+    """
+    The peak resident set size of this process in bytes, if known. It is
+    the peak over the life of the process, which is why each measurement
+    runs in a process of its own.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(name:str, size:int, seed:int=1, repeat:int=3,
+    alloc_limit:int=1 << 23, optimized:bool=False, **options) -> dict:
+    """
+    Parse a generated input of `size` characters with the grammar `name`,
+    and return the best of `repeat` timings. Allocations are counted with
+    tracemalloc in a separate, untimed run, and only for inputs no larger
+    than alloc_limit, since tracing slows parsing many times over.
+
+    The whole input must be parsed, with parse_strict(), so that a grammar
+    that stopped early raises a ParseError rather than seeming faster.
+
+    The peak RSS is read after the timed runs and before tracing, and is
+    the peak of the whole process: call measure() through isolated() to
+    have that of this grammar and size alone.
+    """
+    grammar, generate_input = REFERENCE[name]
+    parser = optimize(grammar()) if optimized else grammar()
+    text = generate_input(size, seed)
+
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = perf_counter()
+        parser.parse_strict(text, **options)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rss = peak_rss()
+
+    allocations = None
+    if len(text) <= alloc_limit:
+        gc.collect()
+        tracemalloc.start()
+        parser.parse_strict(text, **options)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocations = peak
+
+    return {
+        'grammar': name,
+        'size': size,
+        'chars': len(text),
+        'seconds': best,
+        'mb_per_second': len(text) / best / 1e6,
+        'ns_per_char': best * 1e9 / len(text),
+        'peak_traced_bytes': allocations,
+        'peak_rss_bytes': rss,
+        }
+
+
+def _measure_in_child(args:tuple, kwargs:dict) -> dict:
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+    return measure(*args, **kwargs)
+
+
+def isolated(*args, **kwargs) -> dict:
+    """
+    measure(*args, **kwargs), run in a newly spawned process, so that its
+    peak RSS is not that of any measurement before it.
+    """
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(_measure_in_child, args, kwargs).result()
+
+
+ENVIRONMENT = ('python', 'implementation', 'machine', 'options')
+
+def differences(report:dict, baseline:dict) -> list:
+    """
+    Return a line for each of ENVIRONMENT in which the baseline differs
+    from this report, as timings taken under different conditions cannot
+    be compared.
+    """
+    return [f'{key}: {baseline.get(key)!r} in the baseline, {report[key]!r} now'
+        for key in ENVIRONMENT if baseline.get(key) != report[key]]
+
+
+def compare(results:list, baseline:dict, threshold:float) -> list:
+    """
+    Return a line for each result that is slower, in ns per character,
+    than the baseline result of the same grammar and size by more than
+    threshold, a fraction.
+    """
+    before = {(r['grammar'], r['size']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = before.get((r['grammar'], r['size']))
+        if old is None:
+            continue
+        change = r['ns_per_char'] / old['ns_per_char'] - 1
+        if change > threshold:
+            regressions.append(f"{r['grammar']} at {r['size']}: "
+                f"{old['ns_per_char']:.1f} -> {r['ns_per_char']:.1f} ns/char (+{change:.0%})")
+    return regressions
+
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--grammars', default=','.join(REFERENCE),
+        help='comma separated names, from ' + ', '.join(REFERENCE))
+    parser.add_argument('--sizes', default='1K,64K,1M',
+        help='comma separated input sizes, e.g. 1K,1M,100M')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--packrat', action='store_true')
+    parser.add_argument('--engine', default=None, choices=('recursive', 'trampoline'))
+    parser.add_argument('--optimize', action='store_true', help='run optimize() on each grammar')
+    parser.add_argument('--save', metavar='FILE', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.10,
+        help='the slowdown, as a fraction, that counts as a regression')
+    args = parser.parse_args(argv)
+
+    options = {'engine': args.engine}
+    if args.packrat:
+        options['packrat'] = True
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    results = []
+    for name in args.grammars.split(','):
+        for size in args.sizes.split(','):
+            r = isolated(name, parse_size(size), args.seed, args.repeat, 
+                optimized=args.optimize, **options)
+            results.append(r)
+            print(f"{name:>12} {r['chars']:>12,} chars {r['mb_per_second']:8.2f} MB/s "
+                f"{r['ns_per_char']:9.1f} ns/char", flush=True)
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'options': dict(options, optimize=args.optimize),
+        'results': results,
+        }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        mismatched = differences(report, baseline)
+        if mismatched:
+            print('not compared; the baseline was run differently:', file=sys.stderr)
+            for line in mismatched:
+                print('   ', line, file=sys.stderr)
+            return 2
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print('REGRESSION', line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
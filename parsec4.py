@@ -73,13 +73,28 @@ if sys.version_info < min_py:
 ###
 # Other standard distro imports
 ###
+from   array import array
+import bisect
 from   collections import namedtuple
+from   collections import OrderedDict
 from   collections.abc import Callable
 from   collections.abc import Iterable
+from   collections import deque
+import concurrent.futures
 import datetime
 from   functools import wraps
+import hashlib
+import importlib
+import itertools
+import json
+import heapq
+import mmap
+import pickle
+import random
 import re
 import string
+import threading
+from   time import perf_counter
 import warnings
 
 ##########################################################################
@@ -123,9 +138,17 @@ PERCENT = '%'
 ##########################################################################
 # SECTION 1: Parsec.Error
 ##########################################################################
+class ParseError: pass
+class ParseContext: pass
 class ParseError(RuntimeError):
     """
     This exception is raised at the first unrecoverable syntax error.
+
+    index and expected are those of the failure that the parser returned.
+    A failure that some choice, repetition or optional part discarded may
+    have got further; furthest and expectations describe the failures at
+    the furthest point any parser reached, which is where the message
+    says the error is.
     """
 
     def __init__(self, expected:str, text:str, index:tuple):
@@ -134,47 +157,180 @@ class ParseError(RuntimeError):
         text     -- the text that was found.
         index    -- where in the current text shred the error is located.
         """
-        self.expected = expected
+        self.expected = str(expected) if expected.__class__ is Expected else expected
         self.text = text
         self.index = index
+        self.lines = None
+        self.furthest = index
+        self.failures = [expected]
+
+
+    def __reduce__(self) -> tuple:
+        """
+        The error can be sent back from a worker process. The failures
+        are rendered first, since their arguments may be anything, and
+        a mapped text is sent as bytes. The error is rebuilt from its
+        state, so that a subclass comes back as itself.
+        """
+        state = dict(self.__dict__, failures=[str(f) for f in self.failures])
+        text = self.text
+        if isinstance(text, (memoryview, mmap.mmap)):
+            text = bytes(text)
+        return ParseError.__new__, (self.__class__,), dict(state, text=text)
+
+
+    def merge(self, context:ParseContext) -> ParseError:
+        """
+        Take in the failures that the parse in context discarded. If any
+        of them got further into the text than the failure that was
+        returned, the error is reported where the furthest ones were.
+        """
+        if context.furthest > self.furthest:
+            self.furthest, self.failures = context.furthest, _expand(context)
+        elif context.furthest == self.furthest:
+            self.failures = _expand(context) + self.failures
+        return self
+
+
+    @property
+    def expectations(self) -> list:
+        """
+        Everything that would have let the parse go on at self.furthest,
+        without repeats, in the order in which the parsers tried them.
+        """
+        return list(dict.fromkeys(str(e) for e in self.failures))
 
 
     @staticmethod
     def loc_info(text:object, index:int) -> tuple:
         '''
         Location of `index` in source code `text`.
+
+        Within a parse of text, the parse's LineIndex answers; it is built
+        on first use, once per parse. Elsewhere, the lines are counted.
         '''
+        context = _state.context
+        if context is not None and context.text is text:
+            return context.line_index().location(index)
         if index > len(text):
             raise ValueError('Invalid index.')
         if isinstance(text, str):
             line, last_ln = text.count('\n', 0, index), text.rfind('\n', 0, index)
+        elif isinstance(text, (bytes, bytearray, memoryview, mmap.mmap)):
+            head = bytes(text[:index])
+            line, last_ln = head.count(b'\n'), head.rfind(b'\n')
         else:
-            line, last_ln = 0, index
+            line, last_ln = 0, -1
         col = index - (last_ln + 1)
         return (line, col)
 
 
-    def loc(self) -> int:
+    def loc(self) -> str:
         '''
         Locate the error position in the source code text.
         '''
 
         try:
-            return '{}'.format(*ParseError.loc_info(self.text, self.index))
+            if self.lines is not None:
+                return '{}:{}'.format(*self.lines.location(self.furthest))
+            return '{}:{}'.format(*ParseError.loc_info(self.text, self.furthest))
         except ValueError:
-            return f'<out of bounds index {self.index}>'
+            return f'<out of bounds index {self.furthest}>'
 
 
     def __str__(self) -> str:
         """
         This function allows us to meaningfully print the exception.
         """
-        return f'expected: {self.expected} at {self.loc}'
+        return f'expected: {" or ".join(self.expectations)} at {self.loc()}'
+
+
+class LineIndex:
+    """
+    The offsets at which the lines of a text start, so that the line and
+    column of an index can be found by bisection rather than by counting
+    the newlines before it.
+    """
+
+    def __init__(self, text:object):
+        self.length = len(text)
+        self.starts = array('q', [0])
+        if isinstance(text, str):
+            newlines = re.finditer('\n', text)
+        elif isinstance(text, (bytes, bytearray, memoryview, mmap.mmap)):
+            newlines = re.finditer(b'\n', text)
+        else:
+            newlines = ()
+        self.starts.extend(m.end() for m in newlines)
+
+
+    def location(self, index:int) -> tuple:
+        """
+        The (line, column) of index, both counted from zero.
+        """
+        if not 0 <= index <= self.length:
+            raise ValueError('Invalid index.')
+        line = bisect.bisect_right(self.starts, index) - 1
+        return (line, index - self.starts[line])
 
 
 ##########################################################################
 # SECTION 2: Definition the Value model.
 ##########################################################################
+class Expected:
+    """
+    A description of a failure that has not been written out yet. Most
+    failures are discarded by a choice or a many() without anyone reading
+    them, so the parsers that build a description from another Value
+    record a template and its arguments, and the text is made only when
+    it is wanted: when a ParseError is raised, or the Expected is printed.
+
+    An Expected compares and hashes as the string it renders to.
+    """
+    __slots__ = ('template', 'args', 'text')
+
+    def __init__(self, template:str, *args:object):
+        self.template = template
+        self.args = args
+        self.text = None
+
+
+    def __str__(self) -> str:
+        """
+        Render the description. The arguments may be other Expecteds,
+        nested as deeply as the parse was, so they are rendered with a
+        stack of our own rather than by recursion.
+        """
+        if self.text is not None:
+            return self.text
+        stack = [self]
+        while stack:
+            e = stack[-1]
+            pending = [a for a in e.args if a.__class__ is Expected and a.text is None]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            e.text = e.template.format(*(a.text if a.__class__ is Expected else a for a in e.args))
+        return self.text
+
+
+    def __repr__(self) -> str:
+        return repr(str(self))
+
+
+    def __eq__(self, other:object) -> bool:
+        if isinstance(other, (Expected, str)):
+            return str(self) == str(other)
+        return NotImplemented
+
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+
+_new_value = tuple.__new__
+
 class Value: pass
 class Value(namedtuple('Value', 'status index value expected')):
     """
@@ -185,16 +341,20 @@ class Value(namedtuple('Value', 'status index value expected')):
         status   -- bool
         index    -- int
         value    -- object
-        expected -- str
+        expected -- str, or an Expected that renders to one
 
+    Every parser call returns one of these, so the class has no instance
+    __dict__, and the factories build the tuple directly rather than
+    going through the keyword handling of namedtuple's __new__.
     """
+    __slots__ = ()
 
     @staticmethod
     def success(index:int, actual:object) -> Value:
         """
         Factory to create success Value.
         """
-        return Value(True, index, actual, None)
+        return _new_value(Value, (True, index, actual, None))
 
 
     @staticmethod
@@ -202,7 +362,7 @@ class Value(namedtuple('Value', 'status index value expected')):
         """
         Factory to create failure Value.
         """
-        return Value(False, index, None, expected)
+        return _new_value(Value, (False, index, None, expected))
 
 
     def aggregate(self, other:Value=None) -> Value:
@@ -212,7 +372,7 @@ class Value(namedtuple('Value', 'status index value expected')):
         if not self.status: return self
         if not other: return self
         if not other.status: return other
-        return Value(True, other.index, self.value + other.value, None)
+        return _new_value(Value, (True, other.index, self.value + other.value, None))
 
 
     def update_index(self, index:int=None) -> Value:
@@ -221,7 +381,7 @@ class Value(namedtuple('Value', 'status index value expected')):
         """
         return ( self 
             if index is None else 
-                Value(self.status, index, self.value, self.expected)
+                _new_value(Value, (self.status, index, self.value, self.expected))
                 )
 
 
@@ -239,7 +399,7 @@ class Value(namedtuple('Value', 'status index value expected')):
             if not v.status:
                 return v
         out_values = tuple(v.value for v in values)
-        return Value(True, values[-1].index, out_values, None)
+        return _new_value(Value, (True, values[-1].index, out_values, None))
 
 
     def __bool__(self) -> bool:
@@ -257,6 +417,457 @@ class Value(namedtuple('Value', 'status index value expected')):
         return f'Value: {self.status=}, {self.index=}, {self.value=}, {self.expected=}'
 
 
+##########################################################################
+# SECTION 2A: Per-parse state.
+#
+# Each call to parse(), parse_partial(), or parse_strict() runs inside a
+# ParseContext. The context carries whatever side tables belong to that
+# one parse (e.g., the packrat memo table), and it may install a hook
+# that Parser.__call__ consults before running the wrapped function.
+##########################################################################
+
+class _ParseState(threading.local):
+    """
+    The context of the parse running in this thread, if any, and the
+    Profiler that parses begun in this thread report to.
+    """
+    context = None
+    profiler = None
+
+
+_state = _ParseState()
+_state_lock = threading.Lock()
+
+###
+# The number of parses, in any thread, that have installed a hook. While
+# it is zero, Parser.__call__ does not bother to look for a context.
+###
+_hooked_parses = 0
+
+###
+# The Telemetry that top-level parses report to, if one is installed.
+###
+_telemetry = None
+
+
+class MemoTable: pass
+class ReparseTable: pass
+class IncrementalParse: pass
+class Parser: pass
+class Feeder: pass
+class ParseContext: pass
+class ParseContext:
+    """
+    The side state of one top-level parse. Contexts nest: a parse started
+    from inside another parse (e.g., in a parsecmap function) gets its
+    own context, and the outer one is restored when it finishes.
+    """
+    __slots__ = ('text', 'memo', 'hook', 'previous', 'lines', 'furthest', 'expectations')
+
+    def __init__(self, text:str, memo:object=None, hook:Callable=None):
+        """
+        text -- the text being parsed.
+        memo -- a MemoTable, or None for no memoization.
+        hook -- a function of (parser, text, index) to run in place of each
+            parser call; by default, the memo table's lookup, if any.
+        """
+        self.text = text
+        self.memo = memo
+        self.hook = hook if hook is not None else None if memo is None else memo.call
+        if _state.profiler is not None:
+            self.hook = _state.profiler.hook(self.hook)
+        self.previous = None
+        self.lines = None
+        self.furthest = -1
+        self.expectations = []
+
+
+    def discard(self, res:Value) -> None:
+        """
+        Note a failure that a parser is throwing away, if it got at least
+        as far as any other. Only the furthest are kept, unrendered.
+        """
+        if res.index > self.furthest:
+            self.furthest, self.expectations = res.index, [res.expected]
+        elif res.index == self.furthest:
+            self.expectations.append(res.expected)
+
+
+    def forget(self, index:int, known:int) -> None:
+        """
+        Drop the failures noted at index after the first `known` of them,
+        if index is still the furthest.
+        """
+        if self.furthest == index:
+            del self.expectations[known:]
+
+
+    def line_index(self) -> LineIndex:
+        """
+        The LineIndex of the text, built the first time it is wanted.
+        """
+        if self.lines is None:
+            self.lines = LineIndex(self.text)
+        return self.lines
+
+
+    def __enter__(self) -> ParseContext:
+        global _hooked_parses
+        self.previous, _state.context = _state.context, self
+        if self.hook is not None:
+            with _state_lock:
+                _hooked_parses += 1
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        global _hooked_parses
+        _state.context, self.previous = self.previous, None
+        if self.hook is not None:
+            with _state_lock:
+                _hooked_parses -= 1
+
+
+def current_context() -> ParseContext:
+    """
+    Return the context of the parse running in this thread, or None
+    if the parser was called directly rather than through parse().
+    """
+    return _state.context
+
+
+def _discard(res:Value) -> None:
+    """
+    Record a failure that is about to be thrown away in the context of 
+    the parse, so that a ParseError can report it if it was the furthest.
+    """
+    context = _state.context
+    if context is not None and res.index >= context.furthest:
+        context.discard(res)
+
+
+class _Skipped(tuple):
+    """
+    The failures of the alternatives that an optimized choice did not try,
+    because their FIRST sets ruled them out. The choice notes one entry,
+    its (kind, parsers), made when the choice was; like every failure
+    noted in a context it lies at the context's furthest index, so the
+    failures are worked out only if they are wanted for a ParseError, by
+    trying the alternatives there as the plain choice would have.
+    """
+    __slots__ = ()
+
+    def expand(self, text:str, index:int) -> list:
+        """
+        The failures that the plain choice would have discarded at index,
+        in the order it would have discarded them. The failure of the
+        last alternative is the choice's own, and is not among them.
+        """
+        kind, parsers = self
+        with ParseContext(text, None) as context:
+            for p in parsers[:-1]:
+                res = p(text, index)
+                if res.status or (kind == 'choices' and res.index != index):
+                    break
+                _discard(res)
+        return _expand(context) if context.furthest == index else []
+
+
+def _skipping(skipped:_Skipped, index:int) -> None:
+    """
+    Note that an optimized choice is skipping some of its alternatives.
+    """
+    context = _state.context
+    if context is None or index < context.furthest:
+        return
+    if index > context.furthest:
+        context.furthest, context.expectations = index, [skipped]
+    else:
+        context.expectations.append(skipped)
+
+
+def _expand(context:ParseContext) -> list:
+    """
+    The failures noted in a context, with any skipped alternatives
+    worked out.
+    """
+    expectations = context.expectations
+    if not any(e.__class__ is _Skipped for e in expectations):
+        return list(expectations)
+    failures = []
+    for e in expectations:
+        if e.__class__ is _Skipped:
+            failures.extend(e.expand(context.text, context.furthest))
+        else:
+            failures.append(e)
+    return failures
+
+
+class MemoTable:
+    """
+    A packrat memo table. The result of every Parser called during a parse
+    is recorded under the key (parser, index), and a second call of the
+    same parser at the same index returns the recorded result instead
+    of parsing again. This makes heavy use of backtracking (^) linear
+    rather than exponential.
+
+    The table is bounded by maxsize entries. Two eviction policies are
+    available:
+
+        'lru'    -- discard the least recently used entry.
+        'window' -- discard entries that lie more than `window` characters
+                    behind the furthest index memoized so far; parsers
+                    rarely backtrack that far.
+
+    hits, misses, and evictions accumulate across parses so that the
+    effect of the table can be judged; reset_stats() zeroes them.
+    """
+
+    def __init__(self, maxsize:int=100_000, policy:str='lru', window:int=4096):
+        if policy not in ('lru', 'window'):
+            raise ValueError(f'Unknown eviction policy {policy!r}.')
+        if maxsize is not None and maxsize < 1:
+            raise ValueError(f'{maxsize=} must be positive.')
+        self.maxsize = sys.maxsize if maxsize is None else maxsize
+        self.policy = policy
+        self.window = window
+        self.entries = OrderedDict()
+        self.high = 0
+        self.growing = {}
+        self.reset_stats()
+
+
+    @staticmethod
+    def from_option(packrat:object) -> MemoTable:
+        """
+        Interpret the packrat argument of parse() and friends: None or
+        False for no memoization, True for a table with default settings,
+        an int for a table of that size, or a MemoTable to use as is.
+        """
+        if packrat is None or packrat is False:
+            return None
+        if packrat is True:
+            return MemoTable()
+        if isinstance(packrat, int):
+            return MemoTable(maxsize=packrat)
+        if isinstance(packrat, MemoTable):
+            return packrat
+        raise TypeError(f'Cannot use {packrat!r} as a memo table.')
+
+
+    def call(self, parser:Parser, text:str, index:int) -> Value:
+        """
+        Return the memoized result of parser at index, running the
+        parser only if there is none.
+        """
+        if self.growing and index in self.growing:
+            return parser.fn(text, index)
+
+        key = parser, index
+        entries = self.entries
+        try:
+            value = entries[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            if self.policy == 'lru':
+                entries.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = parser.fn(text, index)
+        self.store(key, value)
+        return value
+
+
+    def store(self, key:tuple, value:object) -> None:
+        """
+        Record value under key, evicting entries as the policy requires.
+        """
+        entries = self.entries
+        entries[key] = value
+        index = key[1]
+        if self.policy == 'window':
+            if index > self.high:
+                self.high = index
+            floor = self.high - self.window
+            while entries and (
+                len(entries) > self.maxsize or next(iter(entries))[1] < floor):
+                entries.popitem(last=False)
+                self.evictions += 1
+        elif len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def hold(self, index:int) -> None:
+        """
+        Stop memoizing at index until a matching release(); used while a
+        LeftRecursive rule grows its seed there.
+        """
+        self.growing[index] = self.growing.get(index, 0) + 1
+
+
+    def release(self, index:int) -> None:
+        if self.growing[index] == 1:
+            del self.growing[index]
+        else:
+            self.growing[index] -= 1
+
+
+    def forget_from(self, index:int) -> None:
+        """
+        Forget the entries whose results reach index or beyond; a Feeder
+        does this when the text is about to grow past index.
+        """
+        stale = [key for key, value in self.entries.items() if value.index >= index]
+        for key in stale:
+            del self.entries[key]
+
+
+    def clear(self) -> None:
+        """
+        Forget all entries, e.g., before parsing a different text. The
+        statistics are kept.
+        """
+        self.entries.clear()
+        self.high = 0
+
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+
+    def stats(self) -> dict:
+        """
+        Return the hit/miss statistics as a dict.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries),
+            'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def __str__(self) -> str:
+        return 'MemoTable: ' + ', '.join(f'{k}={v}' for k, v in self.stats().items())
+
+
+class ReparseTable(MemoTable):
+    """
+    A memo table that also records, for each entry, the span of text on
+    which the result depends, so that after an edit the entries clear of
+    the edited region can be kept (those after it shifted) and the rest
+    dropped. See Parser.parse_incremental() and Parser.reparse().
+
+    A result depends on the text from the lowest index at which it, or
+    anything it called, was applied, up to `lookahead` characters past
+    the furthest index at which any of those calls ended. The lookahead
+    covers primitives that look beyond the end of what they match, as 
+    a regex does when it stops, or fails part of the way through.
+    """
+
+    def __init__(self, maxsize:int=None, policy:str='lru', lookahead:int=16):
+        super().__init__(maxsize, policy)
+        self.lookahead = lookahead
+        self.spans = []
+
+
+    def call(self, parser:Parser, text:str, index:int) -> Value:
+        spans = self.spans
+        span = [index, index]
+        key = parser, index
+        entry = None if self.growing and index in self.growing else self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            if self.policy == 'lru':
+                self.entries.move_to_end(key)
+            value, low, reach = entry
+        else:
+            spans.append(span)
+            try:
+                value = parser.fn(text, index)
+            finally:
+                spans.pop()
+            ###
+            # mark reports a line and column, which depend on all the
+            # text before it, even on text inserted at the very start.
+            ###
+            low = -1 if parser.kind == 'mark' else span[0]
+            reach = max(span[1], value.index + self.lookahead)
+            if not (self.growing and index in self.growing):
+                self.misses += 1
+                self.store(key, (value, low, reach))
+
+        if spans:
+            outer = spans[-1]
+            if low < outer[0]:
+                outer[0] = low
+            if reach > outer[1]:
+                outer[1] = reach
+        return value
+
+
+    def edited(self, start:int, end:int, delta:int) -> ReparseTable:
+        """
+        A table for the text in which text[start:end] has been replaced
+        by one longer by delta characters. This table is unchanged.
+        """
+        table = ReparseTable(self.maxsize, self.policy, self.lookahead)
+        kept = table.entries
+        for (parser, index), (value, low, reach) in self.entries.items():
+            if reach <= start:
+                kept[parser, index] = value, low, reach
+            elif low >= end:
+                kept[parser, index + delta] = (
+                    value.update_index(value.index + delta), low + delta, reach + delta)
+        return table
+
+
+class IncrementalParse:
+    """
+    The outcome of Parser.parse_incremental() or Parser.reparse(): the
+    text, the result, and the table from which the next reparse starts.
+    """
+
+    def __init__(self, parser:Parser, text:str, result:Value, table:ReparseTable, 
+        context:ParseContext=None):
+        self.parser = parser
+        self.text = text
+        self.result = result
+        self.table = table
+        self.context = context if not result.status else None
+
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.result.status)
+
+
+    @property
+    def value(self) -> object:
+        """
+        The value parsed, or a ParseError raised if the parse failed.
+        """
+        if not self.result.status:
+            error = ParseError(self.result.expected, self.text, self.result.index)
+            raise error if self.context is None else error.merge(self.context)
+        return self.result.value
+
+
+    @property
+    def index(self) -> int:
+        return self.result.index
+
+
 ##########################################################################
 # SECTION 3: The Parser decorator.
 ##########################################################################
@@ -270,7 +881,15 @@ class Parser:
 
     The function should return either Value.success(next_index, value) if
     parsing successfully, or Value.failure(index, expected) on the failure.
+
+    The built-in combinators and primitives also record how each parser
+    was built: `kind` is the name of the combinator or primitive, and
+    `args` are the parsers and other arguments it was built from. A
+    parser wrapped around a user's function has no kind. This is what lets
+    the trampoline engine run the graph without recursion.
     '''
+    kind = None
+    args = ()
 
     def __init__(self, fn:Callable):
         '''
@@ -279,36 +898,243 @@ class Parser:
         self.fn = fn
 
 
+    def _node(self, kind:str, *args) -> Parser:
+        """
+        Record the kind and arguments of a built-in parser, and return it.
+        """
+        self.kind, self.args = kind, args
+        return self
+
+
+    def __reduce__(self) -> tuple:
+        """
+        A parser is pickled as the function that builds it and the 
+        arguments it was built from; see SECTION 16.
+        """
+        return _reduce_parser(self)
+
+
     def __call__(self, text:str, index:int) -> Value:
         '''
         call wrapped function.
         '''
+        ###
+        # A hook is only looked for while some parse has installed one,
+        # so the ordinary call costs no more than a global lookup.
+        ###
+        if _hooked_parses:
+            context = _state.context
+            if context is not None and context.hook is not None:
+                return context.hook(self, text, index)
         return self.fn(text, index)
 
 
-    def parse(self, text:str):
+    def parse(self, text:str, packrat:object=None, engine:str=None):
         '''
         text -- the text to be parsed.
+        packrat, engine -- as for parse_partial.
         '''
-        return self.parse_partial(text)[0]
+        ###
+        # The value alone is wanted, so the rest of the text is not
+        # sliced off; for a large or mapped text that would be a copy.
+        ###
+        return self._parse(text, packrat, engine).value
 
 
-    def parse_partial(self, text:str) -> tuple:
+    def parse_partial(self, text:str, packrat:object=None, engine:str=None) -> tuple:
         '''
         Parse the longest possible prefix of a given string.
 
         Return a tuple of the result value and the rest of the string.
 
         If failed, raise a ParseError. 
+
+        packrat -- memoize the results of every parser for the duration
+            of this parse. See MemoTable.from_option for the choices.
+        engine  -- 'recursive' (the default) to call parsers in the usual
+            way, or 'trampoline' to run the parser graph on an explicit
+            stack, which allows nesting limited only by memory.
         '''
-        result = self(text, 0)
+        result = self._parse(text, packrat, engine)
+        return result.value, text[result.index:]
+
+
+    def _parse(self, text:str, packrat:object, engine:str, strict:bool=False) -> Value:
+        """
+        Apply this parser at the start of text, and return the successful
+        Value or raise a ParseError. If strict, all of the text must be
+        consumed.
+        """
+        telemetry = _telemetry
+        if telemetry is None or not telemetry.sampled():
+            return self._attempt(text, packrat, engine, strict)
+
+        start, ok = perf_counter(), False
+        try:
+            result = self._attempt(text, packrat, engine, strict)
+            ok = True
+            return result
+        finally:
+            telemetry.record(self, text, perf_counter() - start, ok)
+
+
+    def _attempt(self, text:str, packrat:object, engine:str, strict:bool) -> Value:
+        """
+        The body of _parse().
+        """
+        parser = self < eof() if strict else self
+        memo = MemoTable.from_option(packrat)
+        if memo is not None:
+            memo.clear()
+        with ParseContext(text, memo) as context:
+            result = parser._run(text, 0, engine)
         if result.status:
-            return result.value, text[result.index:]
+            return result
+
+        error = ParseError(result.expected, text, result.index).merge(context)
+        error.lines = context.lines
+        raise error
+
+
+    def _run(self, text:str, index:int, engine:str) -> Value:
+        """
+        Apply this parser at index with the chosen engine.
+        """
+        if engine in (None, 'recursive'):
+            return self(text, index)
+        if engine == 'trampoline':
+            return Trampoline(self, text, index).run()
+        raise ValueError(f'Unknown engine {engine!r}.')
+
+
+    def iter_parse(self, text:str, packrat:object=None, engine:str=None, 
+        index:int=0) -> Iterable:
+        """
+        Apply the parser again and again, as many(p) would, and yield the
+        value of each match as soon as it is found rather than building a
+        list of them all. The consumer may stop at any time.
+
+        The whole of the text must be matched: if a match fails, or
+        succeeds without consuming anything, before the end of the text,
+        a ParseError is raised.
+        """
+        memo = MemoTable.from_option(packrat)
+        while index < len(text):
+            if memo is not None:
+                memo.clear()
+            with ParseContext(text, memo) as context:
+                result = self._run(text, index, engine)
+            if not result.status:
+                raise ParseError(result.expected, text, result.index).merge(context)
+            if result.index == index:
+                raise ParseError('a match that consumes input', text, index)
+            yield result.value
+            index = result.index
+
+
+    def parse_many(self, texts:Iterable, workers:int=None, chunksize:int=256,
+        backend:str=None, packrat:object=None, engine:str=None, 
+        strict:bool=False) -> Iterable:
+        """
+        Parse each of many independent texts, in a pool of `workers`
+        processes or threads, and return an iterator over the results in
+        the order of the texts. The result of a text that fails to parse
+        is its ParseError, rather than its value, and the others go on.
+
+        chunksize -- how many texts are sent to a worker at a time.
+        backend -- 'process' (the default) sends the grammar, pickled, to
+            each worker process once; 'thread' shares it among threads,
+            which run in parallel only on a free-threaded Python, and is
+            the default there.
+        strict  -- parse each text as parse_strict() would.
+        """
+        return _parse_many(self, texts, workers, chunksize, backend, packrat, engine, strict)
+
+
+    def parse_incremental(self, text:str, engine:str=None, 
+        lookahead:int=16) -> IncrementalParse:
+        """
+        Parse a prefix of text, as parse() does, and keep what is needed
+        to parse it again cheaply after an edit; see reparse(). A failed
+        parse can be reparsed, too, and its value raises the ParseError.
+
+        lookahead -- how far past the end of its result any primitive may
+            have looked. Results that end this close to an edit are not
+            reused.
+        """
+        table = ReparseTable(lookahead=lookahead)
+        with ParseContext(text, table) as context:
+            result = self._run(text, 0, engine)
+        return IncrementalParse(self, text, result, table, context)
+
+
+    def reparse(self, previous:IncrementalParse, edit_start:int, edit_end:int, 
+        new_text:str, engine:str=None) -> IncrementalParse:
+        """
+        Parse previous.text after text[edit_start:edit_end] is replaced by 
+        new_text. The memoized results that do not depend on the edited
+        region are reused, so that a small edit costs little more than
+        the parsing of the rules that span it.
+        """
+        if previous.parser is not self:
+            raise ValueError('The previous parse was not made by this parser.')
+        old = previous.text
+        if not 0 <= edit_start <= edit_end <= len(old):
+            raise ValueError(f'Invalid edit region {edit_start}:{edit_end}.')
+        text = old[:edit_start] + new_text + old[edit_end:]
+        table = previous.table.edited(edit_start, edit_end, len(new_text) - (edit_end - edit_start))
+        with ParseContext(text, table) as context:
+            result = self._run(text, 0, engine)
+        return IncrementalParse(self, text, result, table, context)
+
+
+    def feeder(self, packrat:object=None, window:int=4096) -> Feeder:
+        """
+        Return a Feeder, which parses text pushed to it a piece at a
+        time with feed(), and finished with close().
+        """
+        return Feeder(self, packrat, window)
+
+
+    def parse_stream(self, source:object, packrat:object=None, engine:str=None,
+        window:int=4096, chunk_size:int=65536) -> Iterable:
+        """
+        Parse text read from a file-like object, or from an iterable of
+        str chunks, without holding all of it in memory. The parser is
+        applied again and again, as many(p) would be, and the value of 
+        each match is yielded as soon as it is found.
+
+        The text is pushed through a Feeder, so a match that reaches the
+        end of the text read so far is suspended until more is read, not
+        started over, and no parser may look more than `window` characters
+        ahead. Text before the current match is discarded, as nothing can
+        backtrack into it, but all of the current match is held: give
+        the parser of one record, not many(record), or the whole input
+        is held until the end. The stream always runs on the trampoline
+        engine, which is what lets a match be suspended; engine is only
+        checked.
+
+        If a match fails, a ParseError is raised whose text is the part
+        of the input still held and whose offset attribute is the 
+        position of that text in the whole input. The failure is only
+        raised once the match has been tried again on more text; if it
+        then comes out differently, the match needs more than `window`
+        characters and a LookaheadError is raised instead.
+        """
+        if engine not in (None, 'recursive', 'trampoline'):
+            raise ValueError(f'Unknown engine {engine!r}.')
+        if hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(chunk_size), source.read(0))
+        else:
+            chunks = iter(source)
 
-        raise ParseError(result.expected, text, result.index)
+        feeder = Feeder(self, packrat, window)
+        for chunk in chunks:
+            yield from feeder.feed(chunk)
+        yield from feeder.close()
 
 
-    def parse_strict(self, text:str) -> Value:
+    def parse_strict(self, text:str, packrat:object=None, engine:str=None) -> Value:
         '''
         Parse the longest possible prefix of the entire given string. If the 
         parser worked successfully and NONE text was rested, return the
@@ -316,11 +1142,12 @@ class Parser:
 
         The difference between `parse` and `parse_strict` is that the entire
         given text must be used for the event to be construed as a success.
+        packrat and engine are as for parse_partial.
         '''
 
         # Note that < is not the gt operator, but the unconsumed end
         # parser of the text shred.
-        return (self < eof()).parse_partial(text)[0]
+        return self._parse(text, packrat, engine, True).value
 
 
     def bind(self, fn:Callable) -> Parser:
@@ -335,7 +1162,7 @@ class Parser:
             result = self(text, index)
             return result if not result.status else fn(result.value)(text, result.index)
 
-        return bind_parser
+        return bind_parser._node('bind', self, fn)
 
 
     def compose(self, other:Parser):
@@ -348,7 +1175,7 @@ class Parser:
         def compose_parser(text:str, index:int):
             result = self(text, index)
             return result if not result.status else other(text, result.index)
-        return compose_parser
+        return compose_parser._node('compose', self, other)
 
 
     def joint(self, *parsers:Iterable):
@@ -371,9 +1198,12 @@ class Parser:
         @Parser
         def choice_parser(text:str, index:int):
             result = self(text, index)
-            return result if result.status or result.index != index else other(text, index)
+            if result.status or result.index != index:
+                return result
+            _discard(result)
+            return other(text, index)
 
-        return choice_parser
+        return choice_parser._node('choice', self, other)
 
 
     def try_choice(self, other:Parser) -> Value:
@@ -386,9 +1216,12 @@ class Parser:
         @Parser
         def try_choice_parser(text:str, index:int):
             result = self(text, index)
-            return result if result.status else other(text, index)
+            if result.status:
+                return result
+            _discard(result)
+            return other(text, index)
 
-        return try_choice_parser
+        return try_choice_parser._node('try_choice', self, other)
 
 
     def skip(self, other:Parser) -> Value:
@@ -408,9 +1241,9 @@ class Parser:
             if end.status:
                 return Value.success(end.index, res.value)
             else:
-                return Value.failure(end.index, f'ends with {end.expected}')
+                return Value.failure(end.index, Expected('ends with {}', end.expected))
 
-        return skip_parser
+        return skip_parser._node('skip', self, other)
 
 
     def ends_with(self, other:Parser) -> Value:
@@ -427,9 +1260,9 @@ class Parser:
             if end.status:
                 return res
             else:
-                return Value.failure(end.index, f'ends with {end.expected}')
+                return Value.failure(end.index, Expected('ends with {}', end.expected))
 
-        return ends_with_parser
+        return ends_with_parser._node('ends_with', self, other)
 
 
     def excepts(self, other:Parser) -> Parser:
@@ -445,11 +1278,11 @@ class Parser:
                 return res
             lookahead = other(text, res.index)
             if lookahead.status:
-                return Value.failure(res.index, f'should not be "{lookahead.value}"')
+                return Value.failure(res.index, Expected('should not be "{}"', lookahead.value))
             else:
                 return res
 
-        return excepts_parser
+        return excepts_parser._node('excepts', self, other)
 
 
     def parsecmap(self, fn:Callable) -> Parser:
@@ -457,13 +1290,20 @@ class Parser:
         Returns a parser that transforms the result of the current parsing
         operation by invoking fn on the result. For example, if you wanted
         to transform the result from a text shred to an int, you would
-        call xxxxxx.parsecmap(int). Note the *two* lambda functions.
+        call xxxxxx.parsecmap(int).
         '''
-        return self.bind(
-            lambda result: Parser(
-                lambda _, index: Value.success(index, fn(result))
-                )
-            )
+        ###
+        # This was written as self.bind() with two lambdas, which built a
+        # new Parser on every successful match. Besides the cost, each of
+        # those throwaway parsers would occupy its own slot in a packrat
+        # memo table.
+        ###
+        @Parser
+        def parsecmap_parser(text:str, index:int):
+            res = self(text, index)
+            return Value.success(res.index, fn(res.value)) if res.status else res
+
+        return parsecmap_parser._node('parsecmap', self, fn)
 
 
     def parsecapp(self, other:Parser) -> Parser:
@@ -475,14 +1315,15 @@ class Parser:
             lambda res: other.parsecmap(
                 lambda x: res(x)
                 )
-            )
+            )._node('parsecapp', self, other)
 
 
     def result(self, result:Value) -> Value:
         '''
         Return a value according to the parameter res when parse successfully.
         '''
-        return self >> Parser(lambda _, index: Value.success(index, result))
+        return (self >> Parser(lambda _, index: Value.success(index, result))
+            )._node('result', self, result)
 
 
     def mark(self):
@@ -498,14 +1339,30 @@ class Parser:
             return ( Value.success(res.index, (pos(text, index), res.value, pos(text, res.index)))
                 if res.status else res )
 
-        return mark_parser
+        return mark_parser._node('mark', self)
 
 
     def desc(self, description):
         '''
         Describe a parser, when it failed, print out the description text.
+
+        The description takes the place of whatever the parser expected
+        at the index where it was called, as the furthest failure.
         '''
-        return self | Parser(lambda _, index: Value.failure(index, description))
+        @Parser
+        def desc_parser(text:str, index:int):
+            context = _state.context
+            if context is None:
+                res = self(text, index)
+                return res if res.status or res.index != index else Value.failure(index, description)
+            furthest, known = context.furthest, len(context.expectations)
+            res = self(text, index)
+            if res.status or res.index != index:
+                return res
+            context.forget(index, known if furthest == index else 0)
+            return Value.failure(index, description)
+
+        return desc_parser._node('desc', self, description)
 
 
     ###
@@ -619,7 +1476,7 @@ def joint(*parsers):
                 return v
             values.append(v)
         return Value.combinate(values)
-    return joint_parser
+    return joint_parser._node('joint', *parsers)
 
 
 def mark(p:Parser):
@@ -629,11 +1486,18 @@ def mark(p:Parser):
     return p.mark()
 
 
-def parse(p:Parser, text:str, index:int=0) -> Value:
+def parse(p:Parser, text:str, index:int=0, packrat:object=None, engine:str=None) -> Value:
     '''
     Parse a string and return the result or raise a ParseError.
     '''
-    return p.parse(text[index:])
+    return p.parse(text[index:], packrat, engine)
+
+
+def iterparse(p:Parser, text:str, index:int=0, packrat:object=None, engine:str=None) -> Iterable:
+    '''
+    Yield the value of each successive match of p in text.
+    '''
+    return p.iter_parse(text, packrat, engine, index)
 
 
 def parsecapp(p:Parser, other:Parser) -> Parser:
@@ -732,7 +1596,7 @@ def generate(fn:Callable) -> Parser:
             else:
                 return Value.success(index, endval)
 
-    return generated.desc(fn.__name__)
+    return generated._node('generate', fn).desc(fn.__name__)
 
 
 ##########################################################################
@@ -746,8 +1610,24 @@ def times(p:Parser, min_times:int, max_times:int=0) -> list:
     '''
     
     max_times = min_times if not max_times else max_times
+    scan = _run_scanner(p)
+
     @Parser
     def times_parser(text:str, index:int) -> Parser:
+        ###
+        # A repeated character class is consumed as one run.
+        ###
+        if scan is not None and isinstance(text, (str, BINARY_TYPES)):
+            end = scan(text, index, min(len(text), index + max_times))
+            if end - index < min_times:
+                return p(text, end)
+            if end - index < max_times:
+                context = _state.context
+                if context is not None and end >= context.furthest:
+                    context.discard(p(text, end))
+            if isinstance(text, str):
+                return Value.success(end, list(text[index:end]))
+            return Value.success(end, [_BYTE[c] for c in text[index:end]])
         
         cnt, values, res = 0, [], None
         while cnt < max_times:
@@ -760,6 +1640,7 @@ def times(p:Parser, min_times:int, max_times:int=0) -> list:
                 index, cnt = res.index, cnt + 1
             else:
                 if cnt >= min_times:
+                    _discard(res)
                     break
                 else:
                     return res  # failed, throw exception.
@@ -781,7 +1662,8 @@ def times(p:Parser, min_times:int, max_times:int=0) -> list:
                         return Value.failure(index, "already at the end; no more input")
         return Value.success(index, values)
 
-    return times_parser
+    times_parser.scans = scan is not None
+    return times_parser._node('times', p, min_times, max_times)
 
 
 def count(p:Parser, n:int) -> list:
@@ -806,9 +1688,10 @@ def optional(p:Parser, default_value=None):
             return Value.success(res.index, res.value)
         else:
             # Return the maybe existing default value without doing anything.
+            _discard(res)
             return Value.success(index, default_value)
 
-    return optional_parser
+    return optional_parser._node('optional', p, default_value)
 
 
 def many(p) -> list:
@@ -827,23 +1710,122 @@ def many1(p:Parser) -> list:
     '''
     return times(p, 1, sys.maxsize)
 
+
 ###
-# NOTE: the following parsers are useful for expressions in 
-# a language that appear like this: a, b, c, d
-# Most languages have these.
+# Runs of characters. many(space()) costs a call, a Value and a list
+# append per character; these scan the whole run at once and return it
+# as a slice of the text.
 ###
-def separated(p:Parser, sep:str, min_times:int, max_times:int=0, end=None) -> list:
-    '''
-    Repeat a parser `p` separated by `s` between `min_times` and `max_times` times.
-    If max_times is omitted, max_times becomes min_times, effectively
-    executing `p` exactly min_times.
+def span_of(chars:str, min_times:int=0, negate:bool=False) -> Parser:
+    """
+    Parse a run of characters found in chars, or with negate=True, of 
+    characters not found in chars. The value is the run, as a str.
 
-    - When `end` is None, a trailing separator is optional (default).
-    - When `end` is True, a trailing separator is required.
-    - When `end` is False, a trailing separator will not be parsed.
+    min_times -- the shortest acceptable run.
+    """
+    if not chars:
+        raise ValueError('span_of() requires at least one character.')
+    chars = chars if isinstance(chars, (str, bytes)) else str(chars)
+    scan = _scan_class(chars, negate)
+    expected = f"{'none' if negate else 'one'} of {chars}"
 
-    This algorithm is greedy, and does not give back; i.e., it is like the
-    splat (*) in regular expressions.
+    @Parser
+    def span_of_parser(text:str, index:int) -> Value:
+        end = scan(text, index, len(text))
+        if end - index < min_times:
+            return Value.failure(end, expected)
+        return Value.success(end, _slice(text, index, end))
+
+    return span_of_parser._node('span_of', chars, min_times, negate)
+
+
+def span_while(predicate:Callable, min_times:int=0) -> Parser:
+    """
+    Parse a run of characters for which predicate is true. The value is 
+    the run, as a str.
+
+    min_times -- the shortest acceptable run.
+    """
+    scan = _scan_while(predicate)
+    expected = f"a character for which {getattr(predicate, '__name__', 'the predicate')} is true"
+
+    @Parser
+    def span_while_parser(text:str, index:int) -> Value:
+        end = scan(text, index, len(text))
+        if end - index < min_times:
+            return Value.failure(end, expected)
+        return Value.success(end, _slice(text, index, end))
+
+    return span_while_parser._node('span_while', predicate, min_times)
+
+
+def _scan_while(predicate:Callable) -> Callable:
+    def scan(text:str, index:int, limit:int) -> int:
+        if isinstance(text, str):
+            while index < limit and predicate(text[index]):
+                index += 1
+        else:
+            while index < limit and predicate(_BYTE[text[index]]):
+                index += 1
+        return index
+    return scan
+
+
+def _scan_class(chars:Union[str, bytes], negate:bool=False) -> Callable:
+    opening = '[^' if negate else '['
+    exp = re.compile(opening + ''.join(re.escape(c) for c in _char_set(chars)) + ']*')
+    byte_chars = _byte_set(chars)
+    if not byte_chars:
+        # No character of the set is a byte: a run in binary text is
+        # empty, or with negate, goes to the limit.
+        def scan(text:str, index:int, limit:int) -> int:
+            if isinstance(text, str):
+                return exp.match(text, index, limit).end()
+            return limit if negate else index
+        return scan
+    byte_exp = re.compile(opening.encode() + b''.join(re.escape(_BYTE[c]) for c in byte_chars) + b']*')
+    def scan(text:str, index:int, limit:int) -> int:
+        return (exp if isinstance(text, str) else byte_exp).match(text, index, limit).end()
+    return scan
+
+
+def _run_scanner(p:Parser) -> Callable:
+    """
+    For a parser of a single character from a known class, a function
+    of (text, index, limit) that returns the end of the run of such
+    characters starting at index. Otherwise, None.
+    """
+    import string
+    kind, args = getattr(p, 'kind', None), getattr(p, 'args', ())
+    if kind == 'space':
+        return _scan_class(string.whitespace)
+    if kind == 'digit':
+        return _scan_class(string.digits)
+    if kind == 'ascii_letter':
+        return _scan_class(string.ascii_letters)
+    if kind == 'letter':
+        return _scan_while(lambda c: c.isalpha())
+    if kind in ('one_of', 'none_of') and isinstance(args[0], (str, bytes)) and _byte_set(args[0]):
+        return _scan_class(args[0], kind == 'none_of')
+    return None
+
+###
+# NOTE: the following parsers are useful for expressions in 
+# a language that appear like this: a, b, c, d
+# Most languages have these.
+###
+def separated(p:Parser, sep:str, min_times:int, max_times:int=0, end=None) -> list:
+    '''
+    Repeat a parser `p` separated by `s` between `min_times` and `max_times` times.
+    If max_times is omitted, max_times becomes min_times, effectively
+    executing `p` exactly min_times.
+
+    - When `end` is None, a trailing separator is optional (default).
+    - When `end` is True, a trailing separator is required.
+    - When `end` is False, a trailing separator will not be parsed.
+
+    This algorithm is greedy, and does not give back; i.e., it is like the
+    splat (*) in regular expressions.
 
     Return list of values returned by `p`.
     '''
@@ -862,6 +1844,7 @@ def separated(p:Parser, sep:str, min_times:int, max_times:int=0, end=None) -> li
                 if cnt < min_times:
                     return res  # error: need more elements, but no `p` found.
                 else:
+                    _discard(res)
                     return Value.success(values_index, values)
 
             # consume the sep
@@ -874,6 +1857,7 @@ def separated(p:Parser, sep:str, min_times:int, max_times:int=0, end=None) -> li
                 if cnt < min_times or (cnt == min_times and end is True):
                     return res  # error: need more elements, but no `sep` found.
                 else:
+                    _discard(res)
                     if end is True:
                         # step back
                         return Value.success(values_index, values)
@@ -886,7 +1870,7 @@ def separated(p:Parser, sep:str, min_times:int, max_times:int=0, end=None) -> li
             values_index = current_value_index
             values.append(current_value)
         return Value.success(values_index, values)
-    return sep_parser
+    return sep_parser._node('separated', p, sep, min_times, max_times, end)
 
 
 def sepBy(p:Parser, sep:str) -> list:
@@ -941,6 +1925,40 @@ def sepEndBy1(p:Parser, sep:str) -> list:
 ##########################################################################
 # SECTION 7: Prebuilt parsers for common operations.
 ##########################################################################
+
+###
+# Binary input. The parsers accept bytes, bytearray, memoryview and mmap
+# as well as str, so that a large file can be mapped and parsed in place.
+# An item of a binary text is an int; the character parsers match it as
+# a bytes of length one, and that is their value.
+###
+BINARY_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+_BYTE = tuple(bytes((i,)) for i in range(256))
+
+
+def _byte_set(s:Union[str, bytes]) -> bytes:
+    """
+    The bytes form of a set of characters. Characters beyond Latin-1 
+    cannot be a single byte, and are left out.
+    """
+    return s if isinstance(s, bytes) else s.encode('latin-1', 'ignore')
+
+
+def _char_set(s:Union[str, bytes]) -> str:
+    """
+    The str form of a set of characters.
+    """
+    return s.decode('latin-1') if isinstance(s, bytes) else s
+
+
+def _slice(text:object, start:int, end:int) -> object:
+    """
+    text[start:end], as bytes rather than a view or a copy that can change
+    when the text is binary.
+    """
+    piece = text[start:end]
+    return bytes(piece) if isinstance(piece, (bytearray, memoryview)) else piece
+
 def any_char() -> Parser:
     '''
     Note the change in name in this version. This function was named any(), but
@@ -949,54 +1967,85 @@ def any_char() -> Parser:
     @Parser
     def any_parser(text:str, index=0) -> Parser:
         if index < len(text):
-            return Value.success(index + 1, text[index])
+            c = text[index]
+            return Value.success(index + 1, _BYTE[c] if c.__class__ is int else c)
         else:
             return Value.failure(index, 'a random char')
 
-    return any_parser
+    return any_parser._node('any_char')
 
 
 def one_of(s:str) -> Parser:
     '''
     Parses a char from specified string.
     '''
+    expected = f'one of {s}'
+    chars, byte_chars = _char_set(s), _byte_set(s)
+
     @Parser
     def one_of_parser(text:str, index=0) -> Parser:
-        if index < len(text) and text[index] in s:
-            return Value.success(index + 1, text[index])
-        else:
-            return Value.failure(index, f'one of {s}')
+        if index < len(text):
+            c = text[index]
+            if c.__class__ is int:
+                c = _BYTE[c]
+                if c in byte_chars:
+                    return Value.success(index + 1, c)
+            elif c in chars:
+                return Value.success(index + 1, c)
+        return Value.failure(index, expected)
 
-    return one_of_parser
+    return one_of_parser._node('one_of', s)
 
 
 def none_of(s) -> Parser:
     '''
     Parses a char NOT from specified string.
     '''
+    expected = f'none of {s}'
+    chars, byte_chars = _char_set(s), _byte_set(s)
+
     @Parser
     def none_of_parser(text, index=0) -> Value:
-        if index < len(text) and text[index] not in s:
-            return Value.success(index + 1, text[index])
-        else:
-            return Value.failure(index, 'none of {}'.format(s))
+        if index < len(text):
+            c = text[index]
+            if c.__class__ is int:
+                c = _BYTE[c]
+                if c not in byte_chars:
+                    return Value.success(index + 1, c)
+            elif c not in chars:
+                return Value.success(index + 1, c)
+        return Value.failure(index, expected)
 
-    return none_of_parser
+    return none_of_parser._node('none_of', s)
 
 
 def space() -> Parser:
     '''
     Parses a whitespace character.
     '''
+    import string
+    return _class_parser(string.whitespace, 'one space')._node('space')
+
+
+def _class_parser(s:str, expected:str) -> Parser:
+    """
+    A parser of one character from s, for str or binary text.
+    """
+    byte_chars = _byte_set(s)
+
     @Parser
-    def space_parser(text, index=0) -> Value:
-        import string
-        if index < len(text) and text[index] in string.whitespace:
-            return Value.success(index + 1, text[index])
-        else:
-            return Value.failure(index, 'one space')
+    def class_parser(text:str, index:int=0) -> Value:
+        if index < len(text):
+            c = text[index]
+            if c.__class__ is int:
+                c = _BYTE[c]
+                if c in byte_chars:
+                    return Value.success(index + 1, c)
+            elif c in s:
+                return Value.success(index + 1, c)
+        return Value.failure(index, expected)
 
-    return space_parser
+    return class_parser
 
 
 def spaces() -> Parser:
@@ -1013,12 +2062,15 @@ def letter() -> Parser:
     """
     @Parser
     def letter_parser(text:str, index:int=0) -> Parser:
-        if index < len(text) and text[index].isalpha():
-            return Value.success(index + 1, text[index])
-        else:
-            return Value.failure(index, 'a letter')
+        if index < len(text):
+            c = text[index]
+            if c.__class__ is int:
+                c = _BYTE[c]
+            if c.isalpha():
+                return Value.success(index + 1, c)
+        return Value.failure(index, 'a letter')
 
-    return letter_parser
+    return letter_parser._node('letter')
 
 
 def ascii_letter() -> Parser:
@@ -1026,31 +2078,16 @@ def ascii_letter() -> Parser:
     Like letter, but restricted to 7-bit ASCII
     """
 
-    @Parser
-    def ascii_letter_parser(text:str, index:int=0) -> Parser:
-        
-        c = text.get(index)
-        if c is not None and (c.islower() or c.isupper()):
-            return Value.success(index + 1, text[index])
-        else:
-            return Value.failure(index, 'an ascii letter')
-
-    return ascii_letter_parser
+    import string
+    return _class_parser(string.ascii_letters, 'an ascii letter')._node('ascii_letter')
 
 
 def digit() -> Parser:
     '''
     Parse a digit. 
     '''
-    @Parser
-    def digit_parser(text:str, index=0):
-        import string
-        if index < len(text) and text[index] in string.digits:
-            return Value.success(index + 1, text[index])
-        else:
-            return Value.failure(index, 'a digit')
-
-    return digit_parser
+    import string
+    return _class_parser(string.digits, 'a digit')._node('digit')
 
 
 def eof() -> Parser:
@@ -1064,30 +2101,51 @@ def eof() -> Parser:
         else:
             return Value.failure(index, 'EOF')
 
-    return eof_parser
+    return eof_parser._node('eof')
 
 
 def regex(exp:str, flags:int=0) -> Parser:
     '''
     Parses according to a regular expression.
+
+    A str pattern is also applied to binary text, by way of a bytes
+    pattern compiled from it on first use. Its literal characters are 
+    matched as UTF-8, and classes such as \\s and \\w are ASCII only.
     '''
-    if isinstance(exp, str):
+    if isinstance(exp, (str, bytes)):
         exp = re.compile(exp, flags)
+    str_pattern = isinstance(exp.pattern, str)
+    binary = []
+
+    def pattern_for(text:object) -> re.Pattern:
+        if isinstance(text, str):
+            return exp if str_pattern else None
+        if not isinstance(text, BINARY_TYPES):
+            return None
+        if not str_pattern:
+            return exp
+        if not binary:
+            try:
+                binary.append(re.compile(exp.pattern.encode('utf-8'), exp.flags & ~re.UNICODE))
+            except (re.error, ValueError):
+                binary.append(None)
+        return binary[0]
 
     @Parser
     def regex_parser(text:str, index:int) -> Parser:
-        if not isinstance(text, str):
-            return Value.failure(index, 
-                "`regex` combinator only accepts string as input, " +
-                f"but got type {type(text)}, value is {text}")
+        pattern = exp if str_pattern and text.__class__ is str else pattern_for(text)
+        if pattern is None:
+            return Value.failure(index, Expected(
+                "`regex` combinator with a {} pattern cannot match text of type {}",
+                type(exp.pattern).__name__, type(text).__name__))
 
-        match = exp.match(text, index)
+        match = pattern.match(text, index)
         if match:
             return Value.success(match.end(), match.group(0))
         else:
             return Value.failure(index, exp.pattern)
 
-    return regex_parser
+    return regex_parser._node('regex', exp)
 
 
 ###
@@ -1140,10 +2198,20 @@ us_phone    = lexeme(US_PHONE)
 ###
 def string_parsec3(s):
     '''Parses a string.'''
+    byte_s = s if isinstance(s, bytes) else s.encode('utf-8')
+
     @Parser
     def string_parser(text, index=0):
+        if isinstance(text, BINARY_TYPES):
+            slen, tlen = len(byte_s), len(text)
+            if text[index:index + slen] == byte_s:
+                return Value.success(index + slen, byte_s)
+            matched = 0
+            while matched < slen and index + matched < tlen and text[index + matched] == byte_s[matched]:
+                matched = matched + 1
+            return Value.failure(index + matched, s)
+
         slen, tlen = len(s), len(text)
-        expression = ''.join(text[index:index + slen]) == s
         if ''.join(text[index:index + slen]) == s:
             return Value.success(index + slen, s)
         else:
@@ -1151,7 +2219,7 @@ def string_parsec3(s):
             while matched < slen and index + matched < tlen and text[index + matched] == s[matched]:
                 matched = matched + 1
             return Value.failure(index + matched, s)
-    return string_parser
+    return string_parser._node('string_parsec3', s)
 
 
 ###
@@ -1160,17 +2228,33 @@ def string_parsec3(s):
 # Value.failure object that is returned.
 ###
 def string_parsec4(s):
-    '''Parses a string.'''
+    '''
+    Parses a string.
+
+    A str literal is matched in binary text as its UTF-8 encoding, and a
+    bytes literal in str text as its decoding; one that is not UTF-8
+    matches no str text.
+    '''
+    byte_s = s if isinstance(s, bytes) else s.encode('utf-8')
+    try:
+        str_s = s if isinstance(s, str) else byte_s.decode('utf-8')
+    except UnicodeDecodeError:
+        str_s = None
+    slen, byte_len = len(str_s or ''), len(byte_s)
+
     @Parser
     def string_parser(text, index=0):
-        slen, tlen = len(s), len(text)
-        expression = ''.join(text[index:index + slen]) == s
-        if ''.join(text[index:index + slen]) == s:
-            return Value.success(index + slen, s)
-        else:
-            return Value.failure(index, s)
+        if isinstance(text, str):
+            if str_s is not None and text.startswith(str_s, index):
+                return Value.success(index + slen, str_s)
+        elif isinstance(text, BINARY_TYPES):
+            if text[index:index + byte_len] == byte_s:
+                return Value.success(index + byte_len, byte_s)
+        elif str_s is not None and ''.join(text[index:index + slen]) == str_s:
+            return Value.success(index + slen, str_s)
+        return Value.failure(index, s)
 
-    return string_parser
+    return string_parser._node('string', s)
 
 ###
 # string is assigned to one or the other based on the environment
@@ -1186,19 +2270,168 @@ def fail_with(message) -> Parser:
     """
     A trivial parser that always blows up.
     """
-    return Parser(lambda _, index: Value.failure(index, message))
+    return Parser(lambda _, index: Value.failure(index, message))._node('fail_with', message)
+
+
+class Forward: pass
+class Forward(Parser):
+    """
+    A rule that is declared before it is defined, so that it can be used
+    in its own definition or in the definitions of the rules it refers to:
+
+        expr = Forward()
+        atom = number() | (lexeme(string('(')) >> expr << lexeme(string(')')))
+        expr.define(sepBy1(atom, lexeme(string('+'))))
+
+    The rule is built once. Calling it calls the definition directly, so
+    deep recursion allocates nothing but the Value results.
+    """
+    kind = 'forward'
+
+    def __init__(self, body:Parser=None, name:str=None):
+        """
+        body -- the definition, if it is already known.
+        name -- an optional name used when reporting an undefined rule.
+        """
+        super().__init__(self._undefined)
+        self.name = name
+        self.body = None
+        if body is not None:
+            self.define(body)
+
+
+    @property
+    def args(self) -> tuple:
+        return (self.body,)
+
+
+    def define(self, body:Parser) -> Forward:
+        """
+        Supply (or replace) the definition of the rule.
+        """
+        self.body = self.fn = body
+        return self
+
+
+    def __setstate__(self, body:Parser) -> None:
+        """
+        Unpickling makes the rule first and defines it afterward, so that
+        the definition can refer to the rule.
+        """
+        if body is not None:
+            self.define(body)
+
+
+    def _undefined(self, text:str, index:int) -> Value:
+        raise ValueError(f'Rule {self.name or "<anonymous>"} used before it was defined.')
+
+
+def ref(name:str=None) -> Forward:
+    """
+    Declare a rule to be defined later with .define().
+    """
+    return Forward(name=name)
 
 
 def fix(fn:Callable) -> Parser:
     '''
     Allow recursive parser using the Y combinator trick.
 
-        Note that this version still yields the stack overflow 
-        problem, and will be fixed in later version.
-
        See also: https://github.com/sighingnow/parsec.py/issues/39.
     '''
-    return (lambda x: x(x))(lambda y: fn(lambda *args: y(y)(*args)))
+    ###
+    # The Y combinator rebuilt the parser returned by fn on every
+    # recursive call. A Forward rule gets the same effect with one
+    # parser graph, built once.
+    ###
+    rule = Forward(name=getattr(fn, '__name__', None))
+    return rule.define(fn(rule))
+
+
+class LeftRecursive: pass
+class LeftRecursive(Forward):
+    """
+    A rule that may refer to itself in the leftmost position, e.g.,
+
+        expr -> expr '-' term | term
+
+    Called directly, such a rule would recurse forever without consuming
+    any input. Instead, the first call at an index plants a failed "seed"
+    for the rule at that index, and the body is evaluated repeatedly; each
+    recursive reference to the rule at that index returns the current seed,
+    and each pass that gets further than the last becomes the new seed.
+    When a pass makes no progress, the last seed is the result. Each pass
+    extends the match by one application of the non-recursive part, so
+    the rule parses in linear time.
+
+    Recursion through other rules (indirect left recursion) works as long
+    as every cycle passes through a LeftRecursive rule.
+    """
+
+    kind = 'left_recursive'
+
+    def __init__(self, body:Parser=None, name:str=None):
+        self.seeds = {}
+        super().__init__(body, name)
+        self.fn = self._grow
+
+
+    def define(self, body:Parser) -> LeftRecursive:
+        """
+        Supply (or replace) the definition of the rule. Unlike Forward,
+        calls still go through the seed-growing loop.
+        """
+        self.body = body
+        return self
+
+
+    def _grow(self, text:str, index:int) -> Value:
+        ###
+        # The seeds belong to one evaluation in one thread; the text is
+        # alive for the duration, so its id() cannot be reused.
+        ###
+        key = threading.get_ident(), id(text), index
+        seeds = self.seeds
+        if key in seeds:
+            return seeds[key]
+        if self.body is None:
+            return self._undefined(text, index)
+
+        ###
+        # While the seed grows, results at this index depend on the seed,
+        # so a packrat table must neither record nor replay them.
+        ###
+        context = _state.context
+        memo = None if context is None else context.memo
+        if memo is not None:
+            memo.hold(index)
+
+        seed = seeds[key] = Value.failure(index, 'a non-left-recursive alternative')
+        try:
+            while True:
+                res = self.body(text, index)
+                if not res.status or (seed.status and res.index <= seed.index):
+                    break
+                seed = seeds[key] = res
+        finally:
+            del seeds[key]
+            if memo is not None:
+                memo.release(index)
+
+        return seed if seed.status else res
+
+
+def left_recursive(fn:Callable) -> LeftRecursive:
+    """
+    Build a LeftRecursive rule in the manner of fix(). `fn` receives the
+    rule itself and returns its definition:
+
+        @left_recursive
+        def expr(expr):
+            return (expr + (string('-') >> term)).parsecmap(subtract) ^ term
+    """
+    rule = LeftRecursive(name=getattr(fn, '__name__', None))
+    return rule.define(fn(rule))
 
 
 def exclude(p: Parser, exclude:Parser) -> Parser:
@@ -1209,11 +2442,11 @@ def exclude(p: Parser, exclude:Parser) -> Parser:
     def exclude_parser(text:str, index:int) -> Value:
         res = exclude(text, index)
         if res.status:
-            return Value.failure(index, 'something other than {}'.format(res.value))
+            return Value.failure(index, Expected('something other than {}', res.value))
         else:
             return p(text, index)
 
-    return exclude_parser
+    return exclude_parser._node('exclude', p, exclude)
 
 
 def lookahead(p: Parser) -> Parser:
@@ -1227,7 +2460,7 @@ def lookahead(p: Parser) -> Parser:
             return Value.success(index, res.value)
         else:
             return Value.failure(index, res.expected)
-    return lookahead_parser
+    return lookahead_parser._node('lookahead', p)
 
 
 def unit(p: Parser) -> Parser:
@@ -1243,7 +2476,7 @@ def unit(p: Parser) -> Parser:
         else:
             return Value.failure(index, res.expected)
 
-    return unit_parser
+    return unit_parser._node('unit', p)
 
 
 ##########################################################################
@@ -1278,6 +2511,14 @@ def timestamp() -> datetime.datetime:
 
 quote  = string(QUOTE2)
 
+def _unicode_escape(s:str) -> str:
+    """
+    The character of an escape such as u00e9. A function of the module,
+    rather than a lambda, so that the parsers that use it can be pickled.
+    """
+    return chr(int(s[1:], 16))
+
+
 def charseq() -> str:
     """
     Returns a sequence of characters, resolving any escaped chars.
@@ -1295,7 +2536,7 @@ def charseq() -> str:
             | string('n').result(LF)
             | string('r').result(CR)
             | string('t').result(TAB)
-            | regex(r'u[0-9a-fA-F]{4}').parsecmap(lambda s: chr(int(s[1:], 16)))
+            | regex(r'u[0-9a-fA-F]{4}').parsecmap(_unicode_escape)
             | quote
         )
     return string_part() | string_esc()
@@ -1341,48 +2582,2519 @@ def everything_else() -> str:
     raise EndOfGenerator(''.join(body))
 
 
-def parser_from_strings(s:str, 
-    cmap:Union[str, Callable]=None) -> Parser:
+def _trie_pattern(words:Iterable) -> str:
+    """
+    A regular expression that matches the longest of the words, built
+    from a trie of their characters so that the words that share a
+    prefix share its match. Greedy optional groups make the longer
+    words win.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = {}
+
+    def pattern(node:dict) -> str:
+        branches = [re.escape(c) + pattern(child) for c, child in node.items() if c]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' not in node:
+            return body
+        return f'(?:{body})?' if len(branches) == 1 and len(body) > 1 else body + '?'
+
+    return pattern(trie)
+
+
+def _named_callable(name:str) -> Callable:
+    """
+    Find a callable given by a (possibly dotted) name such as "int" or
+    "str.lower", first in this module and then among the builtins.
+    """
+    import builtins
+    first, *rest = name.strip().split('.')
+    try:
+        f = globals()[first] if first in globals() else getattr(builtins, first)
+        for attr in rest:
+            f = getattr(f, attr)
+    except (KeyError, AttributeError):
+        raise ValueError(f"Unable to find a callable named {name!r}") from None
+    if not callable(f):
+        raise ValueError(f"{name!r} is not callable")
+    return f
+
+
+def keywords(words:Union[str, Iterable], 
+    cmap:Union[str, Callable]=None,
+    fold:bool=False) -> Parser:
+    """
+    Factory for a parser of any one of a set of words, followed by 
+    optional whitespace.
+
+    words -- a whitespace delimited str, or an iterable of str.
+
+    cmap -- an optional callable, or the name of one, that is applied to
+        the matched word as with .parsecmap().
+
+    fold -- if True, match without regard to case.
+
+    returns -- a Parser that matches the longest word in the set found
+        at the current position, in a single pass over the text. The
+        value is the text as matched.
+    """
+    if isinstance(words, str):
+        words = words.split()
+    words = tuple(dict.fromkeys(words))
+    if not words or not all(isinstance(w, str) and w for w in words):
+        raise ValueError(f"{words=} must be non-empty strings.")
+
+    keys = dict.fromkeys(w.lower() for w in words) if fold else words
+    p = regex(_trie_pattern(keys), re.IGNORECASE if fold else 0)
+    p = p.desc(f"one of {' '.join(words)}")
+    if cmap is not None:
+        p = p.parsecmap(cmap if callable(cmap) else _named_callable(str(cmap)))
+    return lexeme(p)
+
+
+def parser_from_strings(s:Union[str, Iterable], 
+    cmap:Union[str, Callable]=None,
+    fold:bool=False) -> Parser:
     """
     Factory for string parsers. NOTE that this function is not
-        itself a Parser, but returns a Parser object joined 
-        with the try-choice operator (^).
+        itself a Parser, but returns a Parser object that accepts
+        any one of the strings.
 
-    s -- a whitespace delimited string of text.
+    s -- a whitespace delimited string of text, or a sequence of strings.
     
     cmap -- an optional callable to be used as the argument to .parsecmap().
-        If called with a str, the argument is accepted without comment or 
-        checking. If it is a callable, an exception is raised if the 
-        callable is nameless or has a name that cannot be determined 
-        programmatically. 
+        If it is a str, it is taken to be the name of a callable, such 
+        as "int" or "str.lower", and looked up in this module or among
+        the builtins.
 
-        It is worth noting that the name of a callable such as str.lower
-        is "lower" although the name of int is "int". In the first
-        case, you would want to use "str.lower". 
+    fold -- if True, the strings are matched without regard to case.
 
-    returns -- a Parser that tries all the strings non-destructively, and 
-        vacuums up any trailing whitespace. The sub-parsers are tried 
-        deterministically in the order in which they appear in the argument
-        to the factory function. 
+    returns -- a Parser that matches the longest of the strings at the 
+        current position, and vacuums up any trailing whitespace. See 
+        keywords().
 
     NOTE: this factory will work with Parsec3 or Parsec4 strings.
     """
+    return keywords(s, cmap, fold)
+        
+
+
+
+##########################################################################
+# SECTION 11: The trampoline engine.
+#
+# Ordinarily a parser calls its sub-parsers, so every >>, <<, |, ^ and
+# parsecmap in the path to the current position costs a few frames of
+# the C stack, and long chains or deeply nested input end in a
+# RecursionError. The Trampoline runs the same parser graph with an
+# explicit stack of continuations: calling a sub-parser pushes a frame
+# on a list, and a result pops one. Nesting is then limited by the heap.
+#
+# The engine understands the built-in combinators by their `kind`. Any
+# other parser (the primitives, and parsers built around a user's own
+# function) is called in the ordinary way, so packrat memoization and
+# other hooks apply to those calls only.
+##########################################################################
+
+class Trampoline:
+    """
+    A resumable machine that applies `parser` to `text` at `index`.
+    The machine is in one of two modes: it is either about to call
+    `target` at the index held in `arg`, or (with target None) it is
+    returning the Value held in `arg` to the frame on top of the stack.
+
+    Each frame is a list whose first element is the method that resumes
+    it; the rest is whatever that method needs to carry on.
+    """
 
-    if not isinstance(s, str): 
-        raise ParserError(f"{s=} is not a str of whitespace delimited words.")
+    def __init__(self, parser:Parser, text:str, index:int=0):
+        self.text = text
+        self.key = id(text)
+        self.stack = []
+        self.target, self.arg = parser, index
 
-    if cmap is None:
-        # print(" | ".join([ f"lexeme(string('{_}'))" for _ in s ]))
-        return eval(" ^ ".join([ f"lexeme(string('{_}'))" for _ in s ]))
 
-    if callable(cmap):
+    def run(self) -> Value:
+        """
+        Run the machine until the outermost parser returns.
+        """
+        stack, enter = self.stack, self.enter
+        target, arg = self.target, self.arg
         try:
-            cmap = cmap.__name__
-        except Exception as e:
-            raise Exception(f"Unable to get name of {cmap}")
-    else:
-        cmap = str(cmap)
+            while True:
+                if target is not None:
+                    begin = enter.get(getattr(target, 'kind', None))
+                    if begin is None:
+                        target, arg = None, self.leaf(target, arg)
+                    else:
+                        target, arg = begin(self, target, arg)
+                elif stack:
+                    frame = stack.pop()
+                    target, arg = frame[0](self, frame, arg)
+                else:
+                    return arg
+        except BaseException:
+            self.target, self.arg = target, arg
+            self.unwind()
+            raise
 
-    return eval(" ^ ".join([ f"lexeme(string('{_}').parsecmap({cmap}))" for _ in s ]))
-        
 
+    def leaf(self, parser:Parser, index:int) -> Value:
+        """
+        Call a parser that the machine does not take apart.
+        """
+        return parser(self.text, index)
+
+
+    def unwind(self) -> None:
+        """
+        Abandon the frames on the stack, releasing anything they hold.
+        """
+        while self.stack:
+            frame = self.stack.pop()
+            if frame[0] is Trampoline._resume_left_recursive:
+                Trampoline._release_seed(frame)
+            elif frame[0] is Trampoline._resume_generate:
+                frame[1].close()
+
+    ###
+    # The combinators whose second step is a tail call: the frame is
+    # popped before the second parser runs.
+    ###
+    def _enter_first(self, p:Parser, index:int) -> tuple:
+        self.stack.append([self.resume[p.kind], p, index])
+        return p.args[0], index
+
+    def _resume_compose(self, frame:list, res:Value) -> tuple:
+        return (None, res) if not res.status else (frame[1].args[1], res.index)
+
+    def _resume_choice(self, frame:list, res:Value) -> tuple:
+        index = frame[2]
+        if res.status or res.index != index:
+            return None, res
+        _discard(res)
+        return frame[1].args[1], index
+
+    def _resume_try_choice(self, frame:list, res:Value) -> tuple:
+        if res.status:
+            return None, res
+        _discard(res)
+        return frame[1].args[1], frame[2]
+
+    def _enter_desc(self, p:Parser, index:int) -> tuple:
+        context = _state.context
+        mark = None if context is None else (context.furthest, len(context.expectations))
+        self.stack.append([Trampoline._resume_desc, p, index, mark])
+        return p.args[0], index
+
+    def _resume_desc(self, frame:list, res:Value) -> tuple:
+        _, p, index, mark = frame
+        if res.status or res.index != index:
+            return None, res
+        context = _state.context
+        if context is not None and mark is not None:
+            context.forget(index, mark[1] if mark[0] == index else 0)
+        return None, Value.failure(index, p.args[1])
+
+    def _resume_bind(self, frame:list, res:Value) -> tuple:
+        if not res.status:
+            return None, res
+        following = frame[1].args[1](res.value)
+        if isinstance(following, Parser):
+            return following, res.index
+        return None, following(self.text, res.index)
+
+    def _resume_parsecmap(self, frame:list, res:Value) -> tuple:
+        if not res.status:
+            return None, res
+        return None, Value.success(res.index, frame[1].args[1](res.value))
+
+    def _resume_result(self, frame:list, res:Value) -> tuple:
+        if not res.status:
+            return None, res
+        return None, Value.success(res.index, frame[1].args[1])
+
+    def _resume_mark(self, frame:list, res:Value) -> tuple:
+        if not res.status:
+            return None, res
+        start = ParseError.loc_info(self.text, frame[2])
+        return None, Value.success(res.index,
+            (start, res.value, ParseError.loc_info(self.text, res.index)))
+
+    def _resume_optional(self, frame:list, res:Value) -> tuple:
+        if res.status:
+            return None, Value.success(res.index, res.value)
+        _discard(res)
+        return None, Value.success(frame[2], frame[1].args[1])
+
+    def _resume_lookahead(self, frame:list, res:Value) -> tuple:
+        if res.status:
+            return None, Value.success(frame[2], res.value)
+        return None, Value.failure(frame[2], res.expected)
+
+    def _resume_unit(self, frame:list, res:Value) -> tuple:
+        if res.status:
+            return None, Value.success(res.index, res.value)
+        return None, Value.failure(frame[2], res.expected)
+
+    ###
+    # The combinators that look at the results of both parsers.
+    ###
+    def _resume_then(self, frame:list, res:Value) -> tuple:
+        """
+        First half of skip, ends_with, excepts, and parsecapp: keep the
+        first result in the frame and run the second parser.
+        """
+        if not res.status:
+            return None, res
+        frame[0], frame[2] = self.second[frame[1].kind], res
+        self.stack.append(frame)
+        return frame[1].args[1], res.index
+
+    def _second_skip(self, frame:list, end:Value) -> tuple:
+        if end.status:
+            return None, Value.success(end.index, frame[2].value)
+        return None, Value.failure(end.index, Expected('ends with {}', end.expected))
+
+    def _second_ends_with(self, frame:list, end:Value) -> tuple:
+        if end.status:
+            return None, frame[2]
+        return None, Value.failure(end.index, Expected('ends with {}', end.expected))
+
+    def _second_excepts(self, frame:list, lookahead:Value) -> tuple:
+        res = frame[2]
+        if lookahead.status:
+            return None, Value.failure(res.index, Expected('should not be "{}"', lookahead.value))
+        return None, res
+
+    def _second_parsecapp(self, frame:list, other:Value) -> tuple:
+        if not other.status:
+            return None, other
+        return None, Value.success(other.index, frame[2].value(other.value))
+
+    def _enter_exclude(self, p:Parser, index:int) -> tuple:
+        self.stack.append([Trampoline._resume_exclude, p, index])
+        return p.args[1], index
+
+    def _resume_exclude(self, frame:list, res:Value) -> tuple:
+        if res.status:
+            return None, Value.failure(frame[2], Expected('something other than {}', res.value))
+        return frame[1].args[0], frame[2]
+
+    def _enter_forward(self, p:Parser, index:int) -> tuple:
+        if p.body is None:
+            return None, self.leaf(p, index)
+        return p.body, index
+
+    ###
+    # joint, times, and separated loop over their parsers; the frame
+    # carries the loop state.
+    ###
+    def _enter_joint(self, p:Parser, index:int) -> tuple:
+        if not p.args:
+            return None, self.leaf(p, index)
+        self.stack.append([Trampoline._resume_joint, p, []])
+        return p.args[0], index
+
+    def _resume_joint(self, frame:list, res:Value) -> tuple:
+        if not res.status:
+            return None, res
+        parsers, values = frame[1].args, frame[2]
+        values.append(res)
+        if len(values) < len(parsers):
+            self.stack.append(frame)
+            return parsers[len(values)], res.index
+        return None, Value.combinate(values)
+
+    def _enter_times(self, p:Parser, index:int) -> tuple:
+        if p.scans:
+            return None, self.leaf(p, index)
+        if p.args[2] < 1:
+            return None, Value.success(index, [])
+        # resume, parser, index, count, values, checking for end of text
+        self.stack.append([Trampoline._resume_times, p, index, 0, [], False])
+        return p.args[0], index
+
+    def _resume_times(self, frame:list, res:Value) -> tuple:
+        _, p, index, cnt, values, at_end = frame
+        child, min_times, max_times = p.args
+        if at_end:
+            if index != res.index:
+                return None, Value.failure(index, "already at the end; no more input")
+            frame[5] = False
+            self.stack.append(frame)
+            return child, index
+
+        if res.status:
+            if max_times == sys.maxsize and res.index == index:
+                return None, Value.success(index, values)
+            values.append(res.value)
+            index, cnt = res.index, cnt + 1
+            frame[2], frame[3] = index, cnt
+        elif cnt >= min_times:
+            _discard(res)
+            return None, Value.success(index, values)
+        else:
+            return None, res
+
+        if cnt >= max_times:
+            return None, Value.success(index, values)
+        if index >= len(self.text):
+            if cnt >= min_times:
+                return None, Value.success(index, values)
+            frame[5] = True
+        self.stack.append(frame)
+        return child, index
+
+    def _enter_separated(self, p:Parser, index:int) -> tuple:
+        if p.args[3] < 1:
+            return None, Value.success(index, [])
+        # resume, parser, index, count, values_index, values,
+        #   current value index, current value, expecting the separator
+        self.stack.append([Trampoline._resume_separated, p, index, 0, index, [], None, None, False])
+        return p.args[0], index
+
+    def _resume_separated(self, frame:list, res:Value) -> tuple:
+        _, p, index, cnt, values_index, values, current_index, current, at_sep = frame
+        item, sep, min_times, max_times, end = p.args
+        if not at_sep:
+            if not res.status:
+                if cnt < min_times:
+                    return None, res
+                _discard(res)
+                return None, Value.success(values_index, values)
+            frame[6], frame[7] = res.index, res.value
+            frame[2], frame[3] = res.index, cnt + 1
+            frame[8] = True
+            self.stack.append(frame)
+            return sep, res.index
+
+        if res.status:
+            index = res.index
+            if end in [True, None]:
+                current_index = res.index
+        elif cnt < min_times or (cnt == min_times and end is True):
+            return None, res
+        elif end is True:
+            _discard(res)
+            return None, Value.success(values_index, values)
+        else:
+            _discard(res)
+            values.append(current)
+            return None, Value.success(current_index, values)
+
+        values.append(current)
+        frame[2], frame[4], frame[8] = index, current_index, False
+        if cnt >= max_times:
+            return None, Value.success(current_index, values)
+        self.stack.append(frame)
+        return item, index
+
+    ###
+    # The n-ary nodes built by optimize().
+    ###
+    def _enter_choices(self, p:Parser, index:int) -> tuple:
+        if not p.args:
+            return None, self.leaf(p, index)
+        alternatives = p.alternatives(self.text, index)
+        if len(alternatives) != len(p.args):
+            _skipping(p.skipped, index)
+        self.stack.append([Trampoline._resume_choices, p, index, 0, alternatives])
+        return alternatives[0], index
+
+    def _resume_choices(self, frame:list, res:Value) -> tuple:
+        _, p, index, i, alternatives = frame
+        if res.status or (p.kind == 'choices' and res.index != index) or i + 1 == len(alternatives):
+            return None, res
+        _discard(res)
+        frame[3] = i + 1
+        self.stack.append(frame)
+        return alternatives[i + 1], index
+
+    def _enter_sequence(self, p:Parser, index:int) -> tuple:
+        if not p.args[0]:
+            return None, self.leaf(p, index)
+        self.stack.append([Trampoline._resume_sequence, p, [], 0])
+        return p.args[0][0], index
+
+    def _resume_sequence(self, frame:list, res:Value) -> tuple:
+        _, p, values, i = frame
+        parsers, shape, wraps = p.args
+        if not res.status:
+            if wraps[i]:
+                return None, Value.failure(res.index, Expected('ends with ' * wraps[i] + '{}', res.expected))
+            return None, res
+        if parsers[i].kind == 'fused':
+            values.extend(res.value)
+        else:
+            values.append(res.value)
+        if i + 1 < len(parsers):
+            frame[3] = i + 1
+            self.stack.append(frame)
+            return parsers[i + 1], res.index
+        return None, Value.success(res.index, _shape_value(shape, values))
+
+    ###
+    # Generators are resumed with .send(), exactly as generate() does.
+    ###
+    def _enter_generate(self, p:Parser, index:int) -> tuple:
+        return self._step_generate(p.args[0](), None, index)
+
+    def _resume_generate(self, frame:list, res:Value) -> tuple:
+        if not res.status:
+            return None, res
+        return self._step_generate(frame[1], res.value, res.index)
+
+    def _step_generate(self, iterator:object, value:object, index:int) -> tuple:
+        try:
+            parser = iterator.send(value)
+        except StopIteration as stop:
+            endval = stop.value
+        except RuntimeError as error:
+            endval = error.__cause__.value
+        else:
+            self.stack.append([Trampoline._resume_generate, iterator, index])
+            return parser, index
+
+        if isinstance(endval, Parser):
+            return endval, index
+        return None, Value.success(index, endval)
+
+    ###
+    # LeftRecursive rules grow their seeds in a loop of their own.
+    ###
+    def _enter_left_recursive(self, p:Parser, index:int) -> tuple:
+        key = threading.get_ident(), self.key, index
+        if key in p.seeds:
+            return None, p.seeds[key]
+        if p.body is None:
+            return None, self.leaf(p, index)
+
+        context = _state.context
+        memo = None if context is None else context.memo
+        if memo is not None:
+            memo.hold(index)
+        p.seeds[key] = Value.failure(index, 'a non-left-recursive alternative')
+        self.stack.append([Trampoline._resume_left_recursive, p, index, key, memo])
+        return p.body, index
+
+    def _resume_left_recursive(self, frame:list, res:Value) -> tuple:
+        _, p, index, key, memo = frame
+        seed = p.seeds[key]
+        if res.status and (not seed.status or res.index > seed.index):
+            p.seeds[key] = res
+            self.stack.append(frame)
+            return p.body, index
+
+        Trampoline._release_seed(frame)
+        return None, seed if seed.status else res
+
+    @staticmethod
+    def _release_seed(frame:list) -> None:
+        _, p, index, key, memo = frame
+        del p.seeds[key]
+        if memo is not None:
+            memo.release(index)
+
+
+Trampoline.enter = {
+    'compose': Trampoline._enter_first,
+    'choice': Trampoline._enter_first,
+    'try_choice': Trampoline._enter_first,
+    'desc': Trampoline._enter_desc,
+    'bind': Trampoline._enter_first,
+    'parsecmap': Trampoline._enter_first,
+    'result': Trampoline._enter_first,
+    'mark': Trampoline._enter_first,
+    'optional': Trampoline._enter_first,
+    'lookahead': Trampoline._enter_first,
+    'unit': Trampoline._enter_first,
+    'skip': Trampoline._enter_first,
+    'ends_with': Trampoline._enter_first,
+    'excepts': Trampoline._enter_first,
+    'parsecapp': Trampoline._enter_first,
+    'exclude': Trampoline._enter_exclude,
+    'forward': Trampoline._enter_forward,
+    'joint': Trampoline._enter_joint,
+    'times': Trampoline._enter_times,
+    'separated': Trampoline._enter_separated,
+    'generate': Trampoline._enter_generate,
+    'left_recursive': Trampoline._enter_left_recursive,
+    'choices': Trampoline._enter_choices,
+    'try_choices': Trampoline._enter_choices,
+    'sequence': Trampoline._enter_sequence,
+    }
+
+Trampoline.resume = {
+    'compose': Trampoline._resume_compose,
+    'choice': Trampoline._resume_choice,
+    'try_choice': Trampoline._resume_try_choice,
+    'desc': Trampoline._resume_desc,
+    'bind': Trampoline._resume_bind,
+    'parsecmap': Trampoline._resume_parsecmap,
+    'result': Trampoline._resume_result,
+    'mark': Trampoline._resume_mark,
+    'optional': Trampoline._resume_optional,
+    'lookahead': Trampoline._resume_lookahead,
+    'unit': Trampoline._resume_unit,
+    'skip': Trampoline._resume_then,
+    'ends_with': Trampoline._resume_then,
+    'excepts': Trampoline._resume_then,
+    'parsecapp': Trampoline._resume_then,
+    }
+
+Trampoline.second = {
+    'skip': Trampoline._second_skip,
+    'ends_with': Trampoline._second_ends_with,
+    'excepts': Trampoline._second_excepts,
+    'parsecapp': Trampoline._second_parsecapp,
+    }
+
+
+###
+# Push parsing. Because the trampoline keeps the whole state of a parse
+# in its registers and its stack, it can stop between two steps and
+# carry on later with a longer text. A Feeder does that whenever the
+# next step would come within `window` characters of the end of the 
+# input received so far.
+#
+# A parser that the machine does not take apart, such as a regex or a
+# many() that scans a run of characters, may read further than that. If
+# it reaches the end of the input received so far, its result may be
+# cut short, so the step is undone and taken again with more input.
+###
+
+class _EndOfInput(Exception):
+    """
+    Raised by a step of a suspended parse whose parser read to the end
+    of the input received so far.
+    """
+
+
+LOOKAHEAD_LIMIT = 64
+
+class LookaheadError(ParseError):
+    """
+    Raised by a Feeder, or parse_stream(), when a match came out
+    differently once more text was present: it looked further ahead
+    than the window allows, and a larger window is needed.
+    """
+
+    def __init__(self, window:int, text:str, index:int):
+        super().__init__(f'a match within the lookahead window of {window} characters', text, index)
+        self.window = window
+
+
+    def __str__(self) -> str:
+        return (f'match exceeds the lookahead window of {self.window} characters '
+            f'at {self.loc()}; use a larger window')
+
+
+class _SuspendedParse(Trampoline):
+    """
+    A trampoline that stops, rather than take a step too near the end
+    of the text, until its Feeder has more text or has been closed.
+    """
+
+    def __init__(self, feeder:object, parser:Parser, index:int):
+        super().__init__(parser, feeder.buffer, index)
+        self.feeder = feeder
+        ###
+        # The text is replaced each time it grows, so left-recursive
+        # seeds are keyed on an object that lasts as long as the parse.
+        ###
+        self.token = object()
+        self.key = id(self.token)
+        self.failures = -1, []
+
+
+    def leaf(self, parser:Parser, index:int) -> Value:
+        """
+        Call a parser that the machine does not take apart, and raise
+        _EndOfInput if it read to the end of the text while more may come.
+        Anything it noted in the context or the memo table as having
+        reached the end is forgotten, since it will be called again.
+        """
+        text, feeder = self.text, self.feeder
+        if feeder.closed:
+            return parser(text, index)
+        context = _state.context
+        furthest, expectations = context.furthest, context.expectations
+        known = len(expectations)
+        res = parser(text, index)
+        if res.index < len(text):
+            return res
+        context.furthest, context.expectations = furthest, expectations
+        del expectations[known:]
+        if feeder.memo is not None:
+            feeder.memo.forget_from(len(text))
+        raise _EndOfInput()
+
+
+    def run(self) -> Value:
+        """
+        Run until the outermost parser returns, and return its Value, or
+        until more input is needed, and return None.
+        """
+        feeder, stack, enter = self.feeder, self.stack, self.enter
+        target, arg = self.target, self.arg
+        try:
+            while True:
+                if not feeder.closed:
+                    index = arg if target is not None else arg.index if stack else None
+                    if index is not None and index + feeder.window > len(self.text):
+                        self.target, self.arg = target, arg
+                        self.wanted = index + feeder.window
+                        return None
+                if target is not None:
+                    begin = enter.get(getattr(target, 'kind', None))
+                    try:
+                        if begin is None:
+                            target, arg = None, self.leaf(target, arg)
+                        else:
+                            target, arg = begin(self, target, arg)
+                    except _EndOfInput:
+                        self.target, self.arg = target, arg
+                        self.wanted = len(self.text) + 1
+                        return None
+                elif stack:
+                    frame = stack.pop()
+                    target, arg = frame[0](self, frame, arg)
+                else:
+                    return arg
+        except BaseException:
+            self.target, self.arg = target, arg
+            self.unwind()
+            raise
+
+
+class Feeder:
+    """
+    An incremental parse of input that arrives in pieces. The parser is
+    applied again and again, as many(p) would, and each call of feed()
+    returns the values of the matches that the new text completed. A
+    match that is still in progress is suspended, not restarted, so the
+    cost of parsing is linear in the total length of the input.
+
+    No parser may look more than `window` characters beyond the index at
+    which it is called; the parse waits until that much text is present,
+    or until close() says that no more is coming. A match that fails
+    before close() is tried again each time the text after its start
+    doubles, up to LOOKAHEAD_LIMIT times the window, so a ParseError may
+    come some way after the text that caused it; if a try comes out
+    differently, a LookaheadError is raised instead, as the match needs
+    a larger window.
+
+    The chunks are kept in a list, and joined to the text only when the
+    suspended match can go on, and then only once the new text is half
+    as long as the text held, so that a long match fed in small pieces
+    is not copied once per piece.
+    """
+
+    def __init__(self, parser:Parser, packrat:object=None, window:int=4096):
+        self.parser = parser
+        self.memo = MemoTable.from_option(packrat)
+        self.window = window
+        self.buffer = ''
+        self.pending = []
+        self.pending_size = 0
+        self.offset = 0
+        self.index = 0
+        self.closed = False
+        self.machine = None
+        self.error = None
+        self.held = None
+        self.retry_at = 0
+
+
+    @property
+    def needs_input(self) -> bool:
+        """
+        True while a match is in progress and waiting for more text.
+        This is not a failure: the parse carries on when text arrives.
+        """
+        return self.machine is not None
+
+
+    def feed(self, chunk:Union[str, bytes]) -> list:
+        """
+        Add chunk to the input, and return the values of any matches
+        it completed. Raises ParseError if a match fails.
+        """
+        if self.closed:
+            raise ValueError('Cannot feed a closed Feeder.')
+        if self.error is not None:
+            raise self.error
+        if chunk:
+            self.pending.append(chunk)
+            self.pending_size += len(chunk)
+        machine = self.machine
+        if machine is not None and (len(self.buffer) + self.pending_size < machine.wanted
+                or 2 * self.pending_size < len(self.buffer) - self.index):
+            return []
+        if self.held is not None and len(self.buffer) + self.pending_size < self.retry_at:
+            return []
+        return self.advance()
+
+
+    def close(self) -> list:
+        """
+        Mark the end of the input, and return the values of the matches 
+        that remained. Raises ParseError if the last match is incomplete.
+        """
+        self.closed = True
+        return self.advance()
+
+
+    def advance(self) -> list:
+        if self.error is not None:
+            raise self.error
+        if self.pending:
+            parts = [self.buffer] + self.pending if self.buffer else self.pending
+            self.buffer = parts[0][:0].join(parts)
+            self.pending, self.pending_size = [], 0
+        values = []
+        while True:
+            if self.machine is None:
+                if self.index >= len(self.buffer):
+                    return values
+                if self.held is not None and not self.closed and len(self.buffer) < self.retry_at:
+                    return values
+                if self.index >= self.window:
+                    self.buffer, self.offset = self.buffer[self.index:], self.offset + self.index
+                    self.index = 0
+                if self.memo is not None:
+                    self.memo.clear()
+                self.machine = _SuspendedParse(self, self.parser, self.index)
+
+            ###
+            # Each run has a context of its own, but the failures that a
+            # suspended match has discarded are carried from one to the next.
+            ###
+            self.machine.text = self.buffer
+            with ParseContext(self.buffer, self.memo) as context:
+                context.furthest, context.expectations = self.machine.failures
+                result = self.machine.run()
+            self.machine.failures = context.furthest, context.expectations
+            if result is None:
+                return values
+
+            self.machine = None
+            error = None
+            if not result.status or result.index == self.index:
+                error = ParseError(result.expected if not result.status else
+                    'a match that consumes input', self.buffer, result.index)
+                if not result.status:
+                    error.merge(context)
+                error.offset = self.offset
+
+            ###
+            # A failure while more input may come is held, and the match
+            # tried again each time the text after its start has doubled,
+            # up to LOOKAHEAD_LIMIT windows of it. If a try comes out
+            # differently, the first depended on text beyond the window.
+            ###
+            if self.held is not None and (error is None or
+                    (error.index, error.furthest, error.expectations) != self.held):
+                error = LookaheadError(self.window, self.buffer, self.index)
+                error.offset = self.offset
+            elif error is not None and not self.closed:
+                seen, limit = len(self.buffer) - self.index, self.window * LOOKAHEAD_LIMIT
+                if seen < limit:
+                    if self.held is None:
+                        self.held = error.index, error.furthest, error.expectations
+                    self.retry_at = self.index + min(2 * seen, limit)
+                    return values
+            if error is not None:
+                self.error = error
+                raise error
+            values.append(result.value)
+            self.index = result.index
+
+
+##########################################################################
+# SECTION 12: Grammar optimization.
+#
+# A grammar written with the operators is a binary tree: a ^ b ^ c ^ d is
+# three try_choice parsers, each of which calls the next, and a + b + c is
+# two joint parsers. optimize() rewrites such a graph into an equivalent
+# one with n-ary nodes, each of which runs a single loop over its parts.
+##########################################################################
+
+###
+# FIRST sets. The FIRST set of a parser is the set of characters with
+# which any text it accepts must begin. A parser with a FIRST set fails,
+# without consuming input, wherever the next character is not in it.
+# None means that the set is unknown, or that the parser can succeed
+# without consuming anything.
+###
+
+_PASS_THROUGH = frozenset(('bind', 'compose', 'skip', 'ends_with', 'excepts',
+    'parsecmap', 'parsecapp', 'result', 'mark', 'desc', 'joint', 'exclude',
+    'forward', 'left_recursive'))
+
+_UNIONS = frozenset(('choice', 'try_choice', 'choices', 'try_choices'))
+
+
+def _regex_first(tree:object) -> frozenset:
+    """
+    The FIRST set of a parsed regular expression, or None.
+    """
+    if not len(tree):
+        return None
+    op, av = tree[0]
+    op = str(op)
+    if op == 'LITERAL':
+        return frozenset(chr(av))
+    if op == 'IN':
+        chars = set()
+        for item_op, item in av:
+            item_op = str(item_op)
+            if item_op == 'LITERAL':
+                chars.add(chr(item))
+            elif item_op == 'RANGE' and item[1] - item[0] < 256:
+                chars.update(chr(c) for c in range(item[0], item[1] + 1))
+            else:
+                return None
+        return frozenset(chars)
+    if op == 'BRANCH':
+        sets = [_regex_first(branch) for branch in av[1]]
+        return None if None in sets else frozenset().union(*sets)
+    if op == 'SUBPATTERN':
+        return None if av[1] & re.IGNORECASE else _regex_first(av[-1])
+    if op == 'ATOMIC_GROUP':
+        return _regex_first(av)
+    if op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') and av[0] >= 1:
+        return _regex_first(av[2])
+    return None
+
+
+def _first_set(p:Parser, seen:set=None) -> frozenset:
+    """
+    The FIRST set of p, derived from the kinds of the built-in parsers,
+    or None.
+    """
+    seen = set() if seen is None else seen
+    while p.kind in _PASS_THROUGH or p.kind in ('sequence', 'fused'):
+        if id(p) in seen or not p.args or p.args[0] is None:
+            return None
+        seen.add(id(p))
+        p = p.args[0][:1] if p.kind in ('sequence', 'fused') else p.args[:1]
+        p = p[0] if p else None
+        if not isinstance(p, Parser):
+            return None
+
+    kind, args = p.kind, p.args
+    if kind in ('string', 'string_parsec3', 'one_of'):
+        if not isinstance(args[0], str) or not args[0]:
+            return None
+        return frozenset(args[0][0]) if kind != 'one_of' else frozenset(args[0])
+    if kind == 'digit':
+        return frozenset('0123456789')
+    if kind == 'span_of':
+        return frozenset(_char_set(args[0])) if args[1] >= 1 and not args[2] else None
+    if kind == 'regex':
+        if not isinstance(args[0].pattern, str) or args[0].flags & re.IGNORECASE:
+            return None
+        tree = _regex_tree(args[0].pattern, args[0].flags)
+        return None if tree is None else _regex_first(tree)
+    if kind in _UNIONS and id(p) not in seen:
+        seen.add(id(p))
+        sets = []
+        for q in args:
+            sets.append(_first_set(q, seen))
+            if sets[-1] is None:
+                return None
+        return frozenset().union(*sets)
+    return None
+
+
+def _dispatcher(parsers:tuple) -> Callable:
+    """
+    Returns a function of (text, index) that gives the alternatives worth
+    trying at index: those that might accept the next character, and
+    then the last alternative, whose failure is the one to report if
+    none of the others succeeds. The table is built on first use, when
+    any Forward rules in the alternatives have been defined.
+
+    The table is of characters. In a binary text an ASCII byte is looked
+    up as its character, which every encoding of the literals agrees
+    with; any other byte, or an item of a list of tokens, is matched 
+    against all the alternatives.
+    """
+    table = None
+
+    def build() -> tuple:
+        try:
+            firsts = [_first_set(p) for p in parsers]
+        except RecursionError:
+            firsts = [None] * len(parsers)
+        if all(f is None for f in firsts):
+            return {}, parsers
+
+        def viable(c:str) -> tuple:
+            alts = tuple(p for p, f in zip(parsers, firsts) if f is None or c in f)
+            return alts if alts and alts[-1] is parsers[-1] else alts + parsers[-1:]
+
+        chars = frozenset().union(*(f for f in firsts if f is not None))
+        return {c: viable(c) for c in chars}, viable(None)
+
+    def alternatives(text:str, index:int) -> tuple:
+        nonlocal table
+        if table is None:
+            table = build()
+        mapping, default = table
+        if not mapping or index >= len(text):
+            return default
+        c = text[index]
+        if c.__class__ is int:
+            if c >= 128:
+                return parsers
+            c = chr(c)
+        elif not isinstance(text, str):
+            return parsers
+        return mapping.get(c, default)
+
+    return alternatives
+
+
+def choices(*parsers:Parser) -> Parser:
+    """
+    The n-ary form of (|): try each parser in turn until one succeeds or
+    one fails after consuming input. Parsers whose FIRST sets rule them
+    out at the next character are not tried.
+    """
+    alternatives = _dispatcher(parsers)
+    skipped = _Skipped(('choices', parsers))
+
+    @Parser
+    def choices_parser(text:str, index:int) -> Value:
+        viable = alternatives(text, index)
+        if len(viable) != len(parsers):
+            ###
+            # _skipping(skipped, index), written out: this is the hot path.
+            ###
+            context = _state.context
+            if context is not None and index >= context.furthest:
+                if index > context.furthest:
+                    context.furthest, context.expectations = index, [skipped]
+                else:
+                    context.expectations.append(skipped)
+        res = None
+        for p in viable:
+            if res is not None:
+                _discard(res)
+            res = p(text, index)
+            if res.status or res.index != index:
+                return res
+        return res
+
+    choices_parser.alternatives = alternatives
+    choices_parser.skipped = skipped
+    return choices_parser._node('choices', *parsers)
+
+
+def try_choices(*parsers:Parser) -> Parser:
+    """
+    The n-ary form of (^): try each parser in turn at the same index until
+    one succeeds. Parsers whose FIRST sets rule them out at the next
+    character are not tried.
+    """
+    alternatives = _dispatcher(parsers)
+    skipped = _Skipped(('try_choices', parsers))
+
+    @Parser
+    def try_choices_parser(text:str, index:int) -> Value:
+        viable = alternatives(text, index)
+        if len(viable) != len(parsers):
+            ###
+            # _skipping(skipped, index), written out: this is the hot path.
+            ###
+            context = _state.context
+            if context is not None and index >= context.furthest:
+                if index > context.furthest:
+                    context.furthest, context.expectations = index, [skipped]
+                else:
+                    context.expectations.append(skipped)
+        res = None
+        for p in viable:
+            if res is not None:
+                _discard(res)
+            res = p(text, index)
+            if res.status:
+                return res
+        return res
+
+    try_choices_parser.alternatives = alternatives
+    try_choices_parser.skipped = skipped
+    return try_choices_parser._node('try_choices', *parsers)
+
+
+def _shape_value(shape:object, values:list) -> object:
+    """
+    Build the value of a sequence from the values of its parts.
+    """
+    if isinstance(shape, int):
+        return values[shape]
+    return tuple(_shape_value(s, values) for s in shape)
+
+
+def sequence(parsers:Iterable, shape:object=None, wraps:Iterable=None) -> Parser:
+    """
+    The n-ary form of (>>), (<<) and (+): apply the parsers one after
+    another, failing as soon as one of them fails.
+
+    shape -- which values to return. An int is the position of the parser
+        whose value is the result; a tuple of shapes builds a tuple, as
+        (+) does. The default is a tuple of all the values.
+    wraps -- for each parser, the number of (<<) operators whose right-hand
+        side it was on. Each one prefixes 'ends with ' to its failure, so
+        that the failures are the same as those of the original operators.
+
+    A fused parser (see fuse_regex) stands for several consecutive parsers,
+    and contributes each of their values in its place.
+    """
+    parsers = tuple(parsers)
+    shape = tuple(range(len(parsers))) if shape is None else shape
+    wraps = (0,) * len(parsers) if wraps is None else tuple(wraps)
+    steps = tuple((p, wrap, p.kind == 'fused') for p, wrap in zip(parsers, wraps))
+
+    @Parser
+    def sequence_parser(text:str, index:int) -> Value:
+        values = []
+        for p, wrap, several in steps:
+            res = p(text, index)
+            if not res.status:
+                if wrap:
+                    return Value.failure(res.index, Expected('ends with ' * wrap + '{}', res.expected))
+                return res
+            if several:
+                values.extend(res.value)
+            else:
+                values.append(res.value)
+            index = res.index
+        return Value.success(index, _shape_value(shape, values))
+
+    return sequence_parser._node('sequence', parsers, shape, wraps)
+
+
+###
+# Regex fusion. Token-level rules such as lexeme(regex(...)) or
+# string('x') >> regex(...) run several re.match calls in a row. Those
+# parts of a sequence whose work is a single regular expression can be
+# matched with one compiled pattern instead.
+###
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+def _regex_tree(pattern:str, flags:int=0) -> object:
+    """
+    The parsed form of a pattern, or None if it cannot be parsed.
+    """
+    try:
+        return sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+
+
+_POSITIONAL_OPS = frozenset(('AT', 'GROUPREF', 'GROUPREF_EXISTS', 'ASSERT', 'ASSERT_NOT'))
+
+def _position_free(tree:object) -> bool:
+    """
+    True if a parsed pattern has no anchors, boundaries, lookarounds or
+    backreferences, i.e., nothing whose meaning could change when the
+    pattern is matched as part of a longer one.
+    """
+    for op, av in tree:
+        if str(op) in _POSITIONAL_OPS:
+            return False
+        for item in (av if isinstance(av, (tuple, list)) else (av,)):
+            if isinstance(item, sre_parse.SubPattern) and not _position_free(item):
+                return False
+            if isinstance(item, (tuple, list)):
+                for sub in item:
+                    if isinstance(sub, sre_parse.SubPattern) and not _position_free(sub):
+                        return False
+    return True
+
+
+_INLINE_FLAGS = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x'))
+
+def _regex_source(p:Parser) -> str:
+    """
+    The source of a pattern that matches what the primitive parser p
+    matches, with p's flags inlined, or None if p cannot be fused.
+    """
+    if p.kind == 'string' and isinstance(p.args[0], str) and p.args[0]:
+        return re.escape(p.args[0])
+    if p.kind == 'one_of' and isinstance(p.args[0], str) and p.args[0]:
+        return '[' + ''.join(re.escape(c) for c in p.args[0]) + ']'
+    if p.kind != 'regex' or not isinstance(p.args[0].pattern, str):
+        return None
+
+    exp = p.args[0]
+    flags = exp.flags & ~re.UNICODE
+    inline = ''.join(letter for flag, letter in _INLINE_FLAGS if flags & flag)
+    if flags & ~sum(flag for flag, _ in _INLINE_FLAGS):
+        return None
+    tree = _regex_tree(exp.pattern, exp.flags)
+    if tree is None or not _position_free(tree):
+        return None
+    ###
+    # A verbose pattern may end in a comment, hence the newline.
+    ###
+    return f'(?{inline}:{exp.pattern}\n)' if flags & re.VERBOSE else f'(?{inline}:{exp.pattern})'
+
+
+def fuse_regex(parsers:Iterable, wraps:Iterable=None) -> Parser:
+    """
+    One parser for a run of consecutive regex, string and one_of parsers
+    in a sequence. Its value is the tuple of their values. Each part is
+    matched atomically, as it would be on its own: the pattern does not
+    backtrack into one part to help the next one match.
+
+    When the combined pattern fails, the parts are run one by one, so the
+    failure index and message are those the parts would have produced.
+    """
+    parsers = tuple(parsers)
+    wraps = (0,) * len(parsers) if wraps is None else tuple(wraps)
+    pieces = []
+    for i, p in enumerate(parsers):
+        source = _regex_source(p)
+        if source is None:
+            raise ValueError(f'Cannot fuse parser of kind {p.kind!r}.')
+        if sys.version_info >= (3, 11):
+            pieces.append(f'(?>(?P<_f{i}>{source}))')
+        else:
+            pieces.append(f'(?=(?P<_f{i}>{source}))(?P=_f{i})')
+    exp = re.compile(''.join(pieces))
+    names = tuple(f'_f{i}' for i in range(len(parsers)))
+    steps = tuple(zip(parsers, wraps))
+
+    @Parser
+    def fused_parser(text:str, index:int) -> Value:
+        if isinstance(text, str):
+            match = exp.match(text, index)
+            if match:
+                return Value.success(match.end(),
+                    match.group(*names) if len(names) > 1 else (match.group(names[0]),))
+
+        values = []
+        for p, wrap in steps:
+            res = p(text, index)
+            if not res.status:
+                if wrap:
+                    return Value.failure(res.index, Expected('ends with ' * wrap + '{}', res.expected))
+                return res
+            values.append(res.value)
+            index = res.index
+        return Value.success(index, tuple(values))
+
+    return fused_parser._node('fused', parsers, wraps)
+
+
+def _rebuild(p:Parser, args:tuple) -> Parser:
+    """
+    Build a parser of the same kind as p from new arguments.
+    """
+    return _builders[p.kind](*args)
+
+
+_builders = {
+    'bind': Parser.bind,
+    'choice': Parser.choice,
+    'compose': Parser.compose,
+    'desc': Parser.desc,
+    'ends_with': Parser.ends_with,
+    'excepts': Parser.excepts,
+    'mark': Parser.mark,
+    'parsecapp': Parser.parsecapp,
+    'parsecmap': Parser.parsecmap,
+    'result': Parser.result,
+    'skip': Parser.skip,
+    'try_choice': Parser.try_choice,
+    'choices': choices,
+    'exclude': exclude,
+    'fused': fuse_regex,
+    'joint': joint,
+    'lookahead': lookahead,
+    'optional': optional,
+    'separated': separated,
+    'sequence': sequence,
+    'times': times,
+    'try_choices': try_choices,
+    'unit': unit,
+    }
+
+
+class _Optimizer:
+    """
+    One optimize() pass over a parser graph. Each parser is rewritten
+    once, however many times it is referred to.
+    """
+
+    def __init__(self, fuse:bool=True):
+        self.fuse = fuse
+        self.done = {}
+
+
+    def __call__(self, p:Parser) -> Parser:
+        if not isinstance(p, Parser):
+            return p
+        try:
+            return self.done[id(p)][1]
+        except KeyError:
+            pass
+
+        if isinstance(p, Forward):
+            ###
+            # Rules may be cyclic, so the new rule is recorded before
+            # its body is rewritten.
+            ###
+            new = type(p)(name=p.name)
+            self.done[id(p)] = p, new
+            if p.body is not None:
+                new.define(self(p.body))
+            return new
+
+        new = self.rewrite(p)
+        self.done[id(p)] = p, new
+        return new
+
+
+    def rewrite(self, p:Parser) -> Parser:
+        if p.kind in ('choice', 'try_choice'):
+            alternatives = [self(q) for q in self.alternatives(p, p.kind)]
+            return (choices if p.kind == 'choice' else try_choices)(*alternatives)
+
+        if p.kind in ('compose', 'skip', 'joint'):
+            parsers, wraps, shape = self.flatten(p)
+            if len(parsers) > 1:
+                parsers = [self(q) for q in parsers]
+                if self.fuse:
+                    parsers, wraps = self.fuse_runs(parsers, wraps)
+                return sequence(parsers, shape, wraps)
+
+        if p.kind not in _builders:
+            return p
+        args = tuple(self.argument(a) for a in p.args)
+        if all(new is old for new, old in zip(args, p.args)):
+            return p
+        return _rebuild(p, args)
+
+
+    def fuse_runs(self, parsers:list, wraps:list) -> tuple:
+        """
+        Replace each run of two or more fusable parsers with one fused
+        parser. The fused parser applies the wraps of its own parts.
+        """
+        new_parsers, new_wraps, run = [], [], []
+
+        def close_run():
+            if len(run) > 1:
+                try:
+                    new_parsers.append(fuse_regex([p for p, _ in run], [w for _, w in run]))
+                    new_wraps.append(0)
+                    run.clear()
+                    return
+                except (ValueError, re.error):
+                    pass
+            for p, w in run:
+                new_parsers.append(p)
+                new_wraps.append(w)
+            run.clear()
+
+        for p, w in zip(parsers, wraps):
+            if _regex_source(p) is None:
+                close_run()
+                new_parsers.append(p)
+                new_wraps.append(w)
+            else:
+                run.append((p, w))
+        close_run()
+        return new_parsers, new_wraps
+
+
+    def argument(self, a:object) -> object:
+        if isinstance(a, tuple) and a and all(isinstance(q, Parser) for q in a):
+            new = tuple(self(q) for q in a)
+            return a if all(x is y for x, y in zip(new, a)) else new
+        return self(a)
+
+
+    def alternatives(self, p:Parser, kind:str) -> list:
+        """
+        The leaves of a tree of (|) or of (^), from left to right. The
+        tree may be as deep as the chain is long, so no recursion here.
+        """
+        leaves, todo = [], [p]
+        while todo:
+            q = todo.pop()
+            if q.kind == kind and id(q) not in self.done:
+                todo += [q.args[1], q.args[0]]
+            else:
+                leaves.append(q)
+        return leaves
+
+
+    def flatten(self, p:Parser) -> tuple:
+        """
+        The parts of a tree of (>>), (<<) and (+), the number of (<<)
+        operators each part is wrapped in, and the shape of the value.
+        The tree is walked in post-order with an explicit stack.
+        """
+        parsers, wraps, shapes = [], [], []
+        todo = [(p, 0, False)]
+        while todo:
+            q, wrap, expanded = todo.pop()
+            if q.kind not in ('compose', 'skip', 'joint') or not q.args or (
+                    q is not p and id(q) in self.done):
+                shapes.append(len(parsers))
+                parsers.append(q)
+                wraps.append(wrap)
+            elif not expanded:
+                todo.append((q, wrap, True))
+                for i in reversed(range(len(q.args))):
+                    todo.append((q.args[i], wrap + (q.kind == 'skip' and i == 1), False))
+            else:
+                n = len(q.args)
+                children = shapes[-n:]
+                del shapes[-n:]
+                shapes.append(children[1] if q.kind == 'compose' else
+                    children[0] if q.kind == 'skip' else tuple(children))
+
+        return parsers, wraps, shapes[0]
+
+
+def optimize(p:Parser, fuse:bool=True) -> Parser:
+    """
+    Return a parser equivalent to p in which chains of (|), of (^), and
+    of (>>), (<<) and (+) have been replaced by n-ary nodes. The values,
+    failure indices and failure messages are those of p, and so are the
+    expectations a ParseError lists: the alternatives that a choice skips
+    by their FIRST sets are tried after all if the error is reported
+    where they were skipped.
+
+    fuse -- also replace consecutive regex, string and one_of parsers
+        within a sequence by a single compiled pattern.
+
+    Parsers that were not built by the combinators in this module, and
+    those produced at parse time by bind() or a generator, are left as
+    they are.
+    """
+    return _Optimizer(fuse)(p)
+
+
+##########################################################################
+# SECTION 13: Profiling.
+#
+# A Profiler installs a hook in the context of every parse begun within
+# its `with` block, so that each call of a parser is counted and timed
+# on its way to the memo table, if any, and the parser's function.
+##########################################################################
+
+class _ProfileEntry:
+    """
+    The counts and times of one parser.
+    """
+    __slots__ = ('parser', 'calls', 'successes', 'failures', 'backtracks', 
+        'retries', 'cumulative', 'own')
+
+    def __init__(self, parser:Parser):
+        self.parser = parser
+        self.calls = self.successes = self.failures = 0
+        self.backtracks = self.retries = 0
+        self.cumulative = self.own = 0.0
+
+
+def _parser_label(p:Parser) -> str:
+    """
+    A short name for p: its description, the name of its rule or its
+    generator function, or its kind and the text or pattern it matches.
+    """
+    kind = p.kind
+    if kind == 'desc':
+        return str(p.args[1])
+    if kind in ('forward', 'left_recursive'):
+        return p.name or kind
+    if kind == 'generate':
+        return f'generate {p.args[0].__name__}'
+    if kind == 'string':
+        return f'string {p.args[0]!r}'
+    if kind == 'regex':
+        return f'regex {p.args[0].pattern!r}'
+    if kind is None:
+        return getattr(p.fn, '__qualname__', repr(p.fn))
+    return kind
+
+
+class Profiler: pass
+class Profiler:
+    """
+    Counts and times the calls of each parser in the parses run in this
+    thread within a `with` block:
+
+        with Profiler() as profile:
+            grammar.parse(text)
+        print(profile)
+        profile.dump(open('profile.json', 'w'))
+
+    For each parser it records the calls, the successes and failures,
+    the failures that had consumed input before they failed (backtracks),
+    the calls at an index where the same parser had already been called 
+    in the same parse (retries), and the time spent in its calls, both in
+    all (cumulative) and outside the other parsers it called (own).
+
+    The trampoline engine calls only the primitives and users' parsers
+    through the hook, so with that engine they alone are profiled.
+    """
+
+    columns = ('label', 'kind', 'calls', 'successes', 'failures', 
+        'backtracks', 'retries', 'cumulative', 'own')
+
+    def __init__(self, timer:Callable=perf_counter):
+        """
+        timer -- a function that returns the time in seconds.
+        """
+        self.timer = timer
+        self.entries = {}
+        self.previous = None
+
+
+    def __enter__(self) -> Profiler:
+        self.previous, _state.profiler = _state.profiler, self
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        _state.profiler, self.previous = self.previous, None
+
+
+    def hook(self, inner:Callable=None) -> Callable:
+        """
+        Return a hook for one parse that profiles each call and passes it
+        on to inner, the hook it replaces, if there is one.
+        """
+        entries, timer = self.entries, self.timer
+        inside = [0.0]
+        active = {}
+        tried = set()
+
+        def profiled(parser:Parser, text:str, index:int) -> Value:
+            key = id(parser)
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = _ProfileEntry(parser)
+            if (key, index) in tried:
+                entry.retries += 1
+            else:
+                tried.add((key, index))
+
+            ###
+            # A rule that calls itself counts its time once, at the 
+            # outermost call, in its cumulative time.
+            ###
+            depth = active.get(key, 0)
+            active[key] = depth + 1
+            inside.append(0.0)
+            start = timer()
+            try:
+                res = parser.fn(text, index) if inner is None else inner(parser, text, index)
+            finally:
+                elapsed = timer() - start
+                entry.own += elapsed - inside.pop()
+                inside[-1] += elapsed
+                active[key] = depth
+                if not depth:
+                    entry.cumulative += elapsed
+
+            entry.calls += 1
+            if res.status:
+                entry.successes += 1
+            else:
+                entry.failures += 1
+                if res.index != index:
+                    entry.backtracks += 1
+            return res
+
+        return profiled
+
+
+    def report(self, sort:str='own', limit:int=None) -> list:
+        """
+        Return a dict for each parser, with the keys in Profiler.columns,
+        in descending order of the column `sort`.
+        """
+        if sort not in self.columns:
+            raise ValueError(f'Cannot sort on {sort!r}.')
+        rows = [ 
+            {'label': _parser_label(e.parser), 'kind': e.parser.kind, 
+             'calls': e.calls, 'successes': e.successes, 'failures': e.failures,
+             'backtracks': e.backtracks, 'retries': e.retries,
+             'cumulative': e.cumulative, 'own': e.own}
+            for e in self.entries.values() ]
+        rows.sort(key=lambda row: (row[sort] is None, row[sort]), reverse=sort not in ('label', 'kind'))
+        return rows if limit is None else rows[:limit]
+
+
+    def to_json(self, sort:str='own', limit:int=None) -> str:
+        """
+        Return the report as JSON text.
+        """
+        return json.dumps(self.report(sort, limit), indent=1)
+
+
+    def dump(self, fp:object, sort:str='own', limit:int=None) -> None:
+        """
+        Write the report as JSON to a file opened for writing text.
+        """
+        json.dump(self.report(sort, limit), fp, indent=1)
+
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+    def __str__(self) -> str:
+        """
+        The twenty parsers with the most time of their own, as a table.
+        """
+        lines = [f'{"calls":>9} {"fail":>9} {"backtrk":>9} {"retry":>9} {"cumul s":>10} {"own s":>10}  parser']
+        for row in self.report('own', 20):
+            lines.append(f'{row["calls"]:>9} {row["failures"]:>9} {row["backtracks"]:>9} '
+                f'{row["retries"]:>9} {row["cumulative"]:>10.6f} {row["own"]:>10.6f}  {row["label"]}')
+        return '\n'.join(lines)
+
+
+##########################################################################
+# SECTION 14: Telemetry.
+#
+# A Telemetry is meant to be left installed in production. It looks at
+# a sample of the calls of parse(), parse_partial() and parse_strict(),
+# and keeps, for each parser so called, histograms of the time taken and 
+# of the length of the text, the numbers of successes and failures, and
+# the slowest texts.
+##########################################################################
+
+class _TelemetryEntry:
+    """
+    What a Telemetry knows about one top-level parser.
+    """
+    __slots__ = ('label', 'successes', 'failures', 'latency', 'size', 'slowest')
+
+    def __init__(self, label:str):
+        self.label = label
+        self.successes = self.failures = 0
+        self.latency = {}
+        self.size = {}
+        self.slowest = []
+
+
+class Telemetry: pass
+class Telemetry:
+    """
+    Sampled statistics of the top-level parses in all threads, while the
+    Telemetry is installed:
+
+        telemetry = Telemetry(rate=0.01, sink='/var/tmp/parsing.json', interval=60)
+        telemetry.install()
+
+    The histograms have power-of-two buckets: a parse that took t
+    microseconds is counted under the least power of two greater than t,
+    and a text of n characters (or bytes) under the least one greater
+    than n. The counts are of the sampled parses only; divide by the rate
+    to estimate the totals.
+    """
+
+    def __init__(self, rate:float=0.01, worst:int=10, sample_chars:int=80, 
+        sink:object=None, interval:float=None):
+        """
+        rate     -- the fraction of the parses that are looked at.
+        worst    -- how many of the slowest texts to keep for each parser.
+        sample_chars -- how much of each slow text to keep.
+        sink     -- where export() sends a snapshot by default: the name
+            of a file, which is replaced, or a function of the snapshot.
+        interval -- if given, export() is called when a parse is recorded
+            this many seconds or more after the last export.
+        """
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError(f'The rate must be between 0 and 1, not {rate}.')
+        self.rate = rate
+        self.worst = worst
+        self.sample_chars = sample_chars
+        self.sink = sink
+        self.interval = interval
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.exported = perf_counter()
+        self.sequence = 0
+
+
+    def install(self) -> Telemetry:
+        """
+        Begin looking at parses, in place of any other Telemetry.
+        """
+        global _telemetry
+        _telemetry = self
+        return self
+
+
+    def uninstall(self) -> None:
+        global _telemetry
+        if _telemetry is self:
+            _telemetry = None
+
+
+    def __enter__(self) -> Telemetry:
+        return self.install()
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.uninstall()
+
+
+    def sampled(self) -> bool:
+        """
+        Whether to look at the parse that is about to start.
+        """
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+    def record(self, parser:Parser, text:object, elapsed:float, ok:bool) -> None:
+        """
+        Count a parse of text by parser that took elapsed seconds.
+        """
+        latency = (int(elapsed * 1e6)).bit_length()
+        size = len(text).bit_length()
+        with self.lock:
+            entry = self.entries.get(parser)
+            if entry is None:
+                entry = self.entries[parser] = _TelemetryEntry(_parser_label(parser))
+            if ok:
+                entry.successes += 1
+            else:
+                entry.failures += 1
+            entry.latency[latency] = entry.latency.get(latency, 0) + 1
+            entry.size[size] = entry.size.get(size, 0) + 1
+
+            ###
+            # The slowest are kept in a heap of at most `worst`, with the
+            # quickest of them on top. The sample is taken only when the 
+            # parse gets into the heap.
+            ###
+            slowest = entry.slowest
+            if len(slowest) < self.worst or elapsed > slowest[0][0]:
+                self.sequence += 1
+                item = (elapsed, self.sequence, len(text), ok, self._sample(text))
+                if len(slowest) < self.worst:
+                    heapq.heappush(slowest, item)
+                else:
+                    heapq.heapreplace(slowest, item)
+            due = self.interval is not None and perf_counter() - self.exported >= self.interval
+
+        if due and self.sink is not None:
+            self.export()
+
+
+    def _sample(self, text:object) -> str:
+        """
+        The start of text, as a str.
+        """
+        head = text[:self.sample_chars]
+        return head if isinstance(head, str) else bytes(head).decode('utf-8', 'replace')
+
+
+    def snapshot(self) -> dict:
+        """
+        Return what is known so far as a dict that can be written as JSON.
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+            return {
+                'rate': self.rate,
+                'parsers': [
+                    {'parser': e.label,
+                     'successes': e.successes,
+                     'failures': e.failures,
+                     'latency_us': {str(1 << b): n for b, n in sorted(e.latency.items())},
+                     'size': {str(1 << b): n for b, n in sorted(e.size.items())},
+                     'slowest': [
+                        {'seconds': t, 'size': n, 'ok': ok, 'sample': sample}
+                        for t, _, n, ok, sample in sorted(e.slowest, reverse=True)]
+                    }
+                    for e in entries ]
+                }
+
+
+    def export(self, sink:object=None) -> dict:
+        """
+        Send a snapshot to sink, or to self.sink, and return it.
+        """
+        sink = self.sink if sink is None else sink
+        if sink is None:
+            raise ValueError('There is nowhere to export to.')
+        self.exported = perf_counter()
+        snapshot = self.snapshot()
+        if callable(sink):
+            sink(snapshot)
+        else:
+            ###
+            # The file is replaced in one step, so that a reader never 
+            # finds half a snapshot.
+            ###
+            partial = f'{os.fspath(sink)}.{os.getpid()}.{threading.get_ident()}'
+            with open(partial, 'w') as f:
+                json.dump(snapshot, f, indent=1)
+            os.replace(partial, sink)
+        return snapshot
+
+
+    def reset(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+##########################################################################
+# SECTION 15: Sampling inputs.
+#
+# sample() walks a parser graph and writes a text that the parser would
+# accept, choosing among the alternatives and the numbers of repetitions
+# at random, so that a grammar can be given stress inputs of any size
+# without hand-written corpora.
+##########################################################################
+
+def _children(p:Parser) -> list:
+    """
+    The parsers that p calls.
+    """
+    if p.kind in ('sequence', 'fused'):
+        return list(p.args[0])
+    if p.kind in ('forward', 'left_recursive'):
+        return [] if p.body is None else [p.body]
+    return [a for a in p.args if isinstance(a, Parser)]
+
+
+def _min_lengths(p:Parser) -> dict:
+    """
+    For each parser reachable from p, keyed by id, the length of the
+    shortest text that the sampler can write for it; infinity for those
+    it cannot. Recursive rules make this a fixed point, found by going
+    over the parsers until nothing gets shorter.
+    """
+    nodes, todo, seen = [], [p], set()
+    while todo:
+        q = todo.pop()
+        if id(q) not in seen:
+            seen.add(id(q))
+            nodes.append(q)
+            todo.extend(_children(q))
+
+    inf = float('inf')
+    m = dict.fromkeys(seen, inf)
+    changed = True
+    while changed:
+        changed = False
+        for q in nodes:
+            kind, args = q.kind, q.args
+            children = [m[id(c)] for c in _children(q)]
+            if kind in ('string', 'string_parsec3'):
+                n = len(args[0]) if isinstance(args[0], str) else inf
+            elif kind == 'regex':
+                tree = _regex_tree(args[0].pattern, args[0].flags) if isinstance(args[0].pattern, str) else None
+                n = inf if tree is None else tree.getwidth()[0]
+            elif kind in ('one_of', 'none_of', 'space', 'digit', 'letter', 'ascii_letter', 'any_char'):
+                n = 1
+            elif kind in ('eof', 'lookahead', 'optional'):
+                n = 0
+            elif kind in ('span_of', 'span_while'):
+                n = args[1]
+            elif kind == 'times':
+                n = args[1] * children[0] if args[1] else 0
+            elif kind == 'separated':
+                n = args[2] * children[0] + max(args[2] - 1, 0) * children[1] if args[2] else 0
+            elif kind in ('choice', 'try_choice', 'choices', 'try_choices'):
+                n = min(children, default=inf)
+            elif kind in ('joint', 'compose', 'skip', 'sequence', 'fused', 'parsecapp'):
+                n = sum(children)
+            elif kind in ('ends_with', 'excepts', 'exclude', 'parsecmap', 'result', 'mark', 
+                    'desc', 'unit', 'forward', 'left_recursive'):
+                n = children[0] if children else inf
+            else:
+                n = inf
+            if n < m[id(q)]:
+                m[id(q)], changed = n, True
+    return m
+
+
+class _Sampler:
+    """
+    Writes one text for a parser. While the text is shorter than the 
+    size wanted, alternatives are chosen at random and repetitions run
+    a random number of times, and the outermost repetition goes on
+    until the size is reached; after that, the shortest alternative and
+    the fewest repetitions are chosen, so that the text is finished.
+    """
+
+    def __init__(self, size:int, rng:random.Random, lengths:dict):
+        import string
+        self.size = size
+        self.rng = rng
+        self.lengths = lengths
+        self.out = []
+        self.length = 0
+        self.repeating = 0
+        self.pool = string.ascii_letters + string.digits + string.punctuation + ' '
+        self.groups = {}
+        self.growable = {}
+
+
+    @property
+    def hungry(self) -> bool:
+        return self.length < self.size
+
+
+    def write(self, s:str) -> None:
+        self.out.append(s)
+        self.length += len(s)
+
+
+    def count(self, low:int, high:int) -> int:
+        """
+        How many times to repeat something, between low and high.
+        """
+        n = low
+        if self.hungry:
+            while n < high and self.rng.random() < 0.6:
+                n += 1
+        return n
+
+
+    def pick(self, alternatives:Iterable) -> Parser:
+        alternatives = [q for q in alternatives if self.lengths[id(q)] < float('inf')]
+        if not alternatives:
+            raise ValueError('None of the alternatives can be sampled.')
+        if not self.hungry:
+            return min(alternatives, key=lambda q: self.lengths[id(q)])
+        ###
+        # Until some repetition is under way to make the text long enough,
+        # the alternatives that lead to one are preferred.
+        ###
+        if not self.repeating:
+            alternatives = [q for q in alternatives if self.grows(q)] or alternatives
+        return self.rng.choice(alternatives)
+
+
+    def grows(self, p:Parser) -> bool:
+        """
+        Whether some repetition, that may go on as long as need be, can
+        be reached from p.
+        """
+        if id(p) not in self.growable:
+            found, todo, seen = False, [p], set()
+            while todo and not found:
+                q = todo.pop()
+                if id(q) not in seen:
+                    seen.add(id(q))
+                    found = (q.kind == 'times' and q.args[2] > q.args[1] + 1 or
+                        q.kind == 'separated' and q.args[3] > q.args[2] + 1)
+                    todo.extend(_children(q))
+            self.growable[id(p)] = found
+        return self.growable[id(p)]
+
+
+    def char(self, test:Callable) -> str:
+        chars = [c for c in self.pool if test(c)]
+        if not chars:
+            raise ValueError('No printable character is acceptable here.')
+        return self.rng.choice(chars)
+
+
+    def emit(self, p:Parser) -> None:
+        kind, args, rng = p.kind, p.args, self.rng
+        if kind in ('string', 'string_parsec3'):
+            if not isinstance(args[0], str):
+                raise ValueError('Only grammars of str can be sampled.')
+            self.write(args[0])
+        elif kind == 'regex':
+            tree = _regex_tree(args[0].pattern, args[0].flags) if isinstance(args[0].pattern, str) else None
+            if tree is None:
+                raise ValueError(f'Cannot sample the pattern {args[0].pattern!r}.')
+            self.groups = {}
+            self.pattern(tree)
+        elif kind == 'one_of':
+            self.write(rng.choice(args[0]))
+        elif kind == 'none_of':
+            self.write(self.char(lambda c: c not in args[0]))
+        elif kind == 'space':
+            self.write(rng.choice(' \t\n') if rng.random() < 0.2 else ' ')
+        elif kind == 'digit':
+            self.write(self.char(str.isdigit))
+        elif kind in ('letter', 'ascii_letter'):
+            self.write(self.char(str.isalpha))
+        elif kind == 'any_char':
+            self.write(self.char(lambda c: True))
+        elif kind == 'span_of':
+            chars, low, negate = args
+            test = (lambda c: c not in chars) if negate else (lambda c: c in chars)
+            for _ in range(self.count(low, sys.maxsize)):
+                self.write(self.char(test))
+        elif kind == 'span_while':
+            for _ in range(self.count(args[1], sys.maxsize)):
+                self.write(self.char(args[0]))
+        elif kind == 'times':
+            self.repeat(args[0], None, args[1], args[2], False)
+        elif kind == 'separated':
+            item, sep, low, high, end = args
+            self.repeat(item, sep, low, high, end is True or (end is None and rng.random() < 0.5))
+        elif kind in ('choice', 'try_choice', 'choices', 'try_choices'):
+            self.emit(self.pick(args))
+        elif kind in ('sequence', 'fused'):
+            for q in args[0]:
+                self.emit(q)
+        elif kind in ('joint', 'compose', 'skip', 'parsecapp'):
+            self.emit(args[0])
+            self.emit(args[1])
+        elif kind == 'optional':
+            if self.hungry and rng.random() < 0.5:
+                self.emit(args[0])
+        elif kind in ('ends_with', 'excepts', 'exclude', 'parsecmap', 'result', 'mark', 'desc', 'unit'):
+            self.emit(args[0])
+        elif kind in ('forward', 'left_recursive'):
+            self.emit(p.body)
+        elif kind not in ('eof', 'lookahead'):
+            raise ValueError(f'Cannot sample a parser of kind {kind}; '
+                'its grammar is known only when it runs.')
+
+
+    def repeat(self, item:Parser, sep:Parser, low:int, high:int, trailing:bool) -> None:
+        outermost = not self.repeating
+        self.repeating += 1
+        n = 0
+        while n < high:
+            if n >= low and not (outermost and self.hungry):
+                if n >= self.count(low, high):
+                    break
+            if n and sep is not None:
+                self.emit(sep)
+            before = self.length
+            self.emit(item)
+            n += 1
+            if self.length == before and n >= low:
+                break
+        if n and trailing and sep is not None:
+            self.emit(sep)
+        self.repeating -= 1
+
+
+    def pattern(self, tree:object) -> None:
+        """
+        Write a text that the parsed regular expression matches.
+        """
+        rng = self.rng
+        for op, av in tree:
+            op = str(op)
+            if op == 'LITERAL':
+                self.write(chr(av))
+            elif op == 'NOT_LITERAL':
+                self.write(self.char(lambda c: c != chr(av)))
+            elif op == 'ANY':
+                self.write(self.char(lambda c: c != '\n'))
+            elif op == 'IN':
+                self.write(self.member(av))
+            elif op == 'BRANCH':
+                branches = av[1]
+                self.pattern(rng.choice(branches) if self.hungry else min(branches, key=lambda b: b.getwidth()[0]))
+            elif op == 'SUBPATTERN':
+                group, sub = av[0], av[-1]
+                start = len(self.out)
+                self.pattern(sub)
+                if group is not None:
+                    self.groups[group] = ''.join(self.out[start:])
+            elif op == 'ATOMIC_GROUP':
+                self.pattern(av)
+            elif op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+                low, high, sub = av
+                for _ in range(self.count(low, min(high, low + 16))):
+                    self.pattern(sub)
+            elif op == 'GROUPREF':
+                self.write(self.groups.get(av, ''))
+            elif op == 'GROUPREF_EXISTS':
+                group, yes, no = av
+                self.pattern(yes if group in self.groups else no or [])
+            elif op not in ('AT', 'ASSERT', 'ASSERT_NOT'):
+                raise ValueError(f'Cannot sample the regular expression operator {op}.')
+
+
+    def member(self, items:list) -> str:
+        """
+        A character of the class [items].
+        """
+        import string
+        categories = {
+            'CATEGORY_DIGIT': string.digits,
+            'CATEGORY_SPACE': ' \t\n',
+            'CATEGORY_WORD': string.ascii_letters + string.digits + '_',
+            }
+        negate = str(items[0][0]) == 'NEGATE'
+        if negate:
+            items = items[1:]
+
+        def contains(c:str) -> bool:
+            for op, av in items:
+                op = str(op)
+                if op == 'LITERAL' and c == chr(av):
+                    return True
+                if op == 'RANGE' and av[0] <= ord(c) <= av[1]:
+                    return True
+                if op == 'CATEGORY':
+                    av = str(av)
+                    if av.startswith('CATEGORY_NOT_'):
+                        if c not in categories.get('CATEGORY_' + av[13:], ''):
+                            return True
+                    elif c in categories.get(av, ''):
+                        return True
+            return False
+
+        if negate:
+            return self.char(lambda c: not contains(c))
+        choices = []
+        for op, av in items:
+            op = str(op)
+            if op == 'LITERAL':
+                choices.append(chr(av))
+            elif op == 'RANGE':
+                choices.append(chr(self.rng.randint(*av)))
+            elif op == 'CATEGORY' and str(av) in categories:
+                choices.append(self.rng.choice(categories[str(av)]))
+        return self.rng.choice(choices) if choices else self.char(contains)
+
+
+def sample(p:Parser, size:int=64, seed:object=None, near_miss:bool=False, 
+    attempts:int=20) -> str:
+    """
+    Return a random text of about `size` characters, or more, that p 
+    accepts in full, as parse_strict() would. The same seed gives the
+    same text. With near_miss, the text is then changed in one place,
+    by deleting, inserting or replacing a character or cutting it short,
+    so that p rejects it.
+
+    The grammar must be built from the combinators and primitives; those
+    whose grammar is known only at parse time, such as @generate and
+    bind(), cannot be sampled. A (|) may choose an alternative that an 
+    earlier one would have got in the way of, so each text is checked,
+    and up to `attempts` are made.
+    """
+    rng = random.Random(seed)
+    lengths = _min_lengths(p)
+    if lengths[id(p)] == float('inf'):
+        raise ValueError('The parser cannot be sampled.')
+
+    for _ in range(attempts):
+        sampler = _Sampler(size, rng, lengths)
+        sampler.emit(p)
+        text = ''.join(sampler.out)
+        try:
+            p.parse_strict(text)
+        except ParseError:
+            continue
+        if not near_miss:
+            return text
+
+        for _ in range(attempts):
+            i = rng.randrange(len(text) + 1)
+            change = rng.randrange(4) if text else 1
+            if change == 0 and i < len(text):
+                missed = text[:i] + text[i + 1:]
+            elif change == 1:
+                missed = text[:i] + rng.choice(sampler.pool) + text[i:]
+            elif change == 2 and i < len(text):
+                missed = text[:i] + sampler.char(lambda c: c != text[i]) + text[i + 1:]
+            else:
+                missed = text[:i]
+            try:
+                p.parse_strict(missed)
+            except ParseError:
+                return missed
+
+    raise ValueError(f'No {"near miss" if near_miss else "valid text"} was found in {attempts} attempts.')
+
+
+##########################################################################
+# SECTION 16: Pickling and fingerprints.
+#
+# The kind and args of a built-in parser say how to build it again, so
+# a parser graph pickles as a tree of calls of the builders, with rules
+# (Forward and LeftRecursive) made first and defined afterward to close
+# the cycles. The functions given to parsecmap(), bind(), span_while(),
+# and so on are pickled by reference, as pickle always does, so they
+# must be defined at the top level of a module.
+##########################################################################
+
+_constructors = dict(_builders,
+    any_char=any_char,
+    ascii_letter=ascii_letter,
+    digit=digit,
+    eof=eof,
+    fail_with=fail_with,
+    letter=letter,
+    none_of=none_of,
+    one_of=one_of,
+    regex=regex,
+    space=space,
+    span_of=span_of,
+    span_while=span_while,
+    string=string_parsec4,
+    string_parsec3=string_parsec3,
+    )
+
+
+def _global_parser(module:str, qualname:str) -> Parser:
+    """
+    The object named qualname in module.
+    """
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _generated(module:str, qualname:str) -> Parser:
+    """
+    The parser made by @generate from the function named qualname in 
+    module. The name refers to the decorated result, which may have been
+    wrapped further (e.g., by desc or lexeme), so its graph is searched.
+    """
+    todo, seen = [_global_parser(module, qualname)], set()
+    while todo:
+        p = todo.pop()
+        if id(p) in seen or not isinstance(p, Parser):
+            continue
+        seen.add(id(p))
+        if p.kind == 'generate' and getattr(p.args[0], '__qualname__', None) == qualname:
+            return p
+        todo.extend(_children(p))
+    raise pickle.UnpicklingError(f'{module}.{qualname} is not a generated parser.')
+
+
+def _reduce_parser(p:Parser) -> tuple:
+    """
+    The value of p.__reduce__().
+    """
+    kind = p.kind
+    if kind in ('forward', 'left_recursive'):
+        return type(p), (None, p.name), p.body
+    if kind == 'generate':
+        fn = p.args[0]
+        if '<' in fn.__qualname__:
+            raise pickle.PicklingError(f'Cannot pickle the generator {fn.__qualname__}; '
+                'it must be defined at the top level of a module.')
+        return _generated, (fn.__module__, fn.__qualname__)
+    if kind is None:
+        ###
+        # A function decorated with @Parser is known by its name, which
+        # now refers to the parser rather than the function.
+        ###
+        fn = p.fn
+        module, qualname = getattr(fn, '__module__', None), getattr(fn, '__qualname__', '')
+        if module is not None and '<' not in qualname:
+            try:
+                if _global_parser(module, qualname) is p:
+                    return _global_parser, (module, qualname)
+            except (ImportError, AttributeError):
+                pass
+        return Parser, (fn,)
+
+    builder = _constructors.get(kind)
+    if builder is None:
+        raise pickle.PicklingError(f'Cannot pickle a parser of kind {kind}.')
+    return builder, p.args
+
+
+def _describe(arg:object, number:Callable) -> str:
+    """
+    A description of an argument of a parser, for fingerprint().
+    """
+    if isinstance(arg, Parser):
+        return f'#{number(arg)}'
+    if isinstance(arg, (tuple, list)):
+        return '(' + ','.join(_describe(a, number) for a in arg) + ')'
+    if isinstance(arg, re.Pattern):
+        return f're({arg.pattern!r},{arg.flags})'
+    code = getattr(arg, '__code__', None)
+    if code is not None:
+        ###
+        # Functions are known by name, and by their code, since lambdas
+        # all have the same name.
+        ###
+        digest = hashlib.sha256(code.co_code + repr(code.co_consts).encode()).hexdigest()[:16]
+        return f'{getattr(arg, "__module__", "")}.{arg.__qualname__}:{digest}'
+    if callable(arg) and hasattr(arg, '__qualname__'):
+        return f'{getattr(arg, "__module__", "")}.{arg.__qualname__}'
+    return repr(arg)
+
+
+def fingerprint(p:Parser) -> str:
+    """
+    A digest of the structure of the graph of p: the kinds, the
+    arguments, and the way the parsers refer to one another. Grammars 
+    built in the same way have the same fingerprint, wherever and
+    whenever they were built, so it can key a cache of anything derived
+    from a grammar.
+    """
+    numbers, todo, lines = {}, [], []
+
+    def number(q:Parser) -> int:
+        if id(q) not in numbers:
+            numbers[id(q)] = len(numbers)
+            todo.append(q)
+        return numbers[id(q)]
+
+    number(p)
+    i = 0
+    while i < len(todo):
+        q = todo[i]
+        i += 1
+        if q.kind is None:
+            lines.append(f'{numbers[id(q)]} fn {_describe(q.fn, number)}')
+        elif q.kind in ('forward', 'left_recursive'):
+            lines.append(f'{numbers[id(q)]} {q.kind} {q.name!r} {_describe(q.body, number)}')
+        else:
+            lines.append(f'{numbers[id(q)]} {q.kind} {_describe(q.args, number)}')
+    return hashlib.sha256('\n'.join(lines).encode()).hexdigest()
+
+
+##########################################################################
+# SECTION 17: Parallel parsing.
+#
+# parse_many() cuts the texts into batches, and parse_file_parallel()
+# cuts a file into ranges of whole records. Either keeps a few tasks per
+# worker in flight, and yields their results in order. A worker process
+# unpickles the grammar once, when it starts; threads share it.
+##########################################################################
+
+def _parse_each(parser:Parser, texts:list, packrat:object, engine:str, strict:bool) -> list:
+    """
+    The value of each text, or its ParseError.
+    """
+    results = []
+    for text in texts:
+        try:
+            results.append(parser._parse(text, packrat, engine, strict).value)
+        except ParseError as error:
+            results.append(error)
+    return results
+
+
+###
+# The grammar and options of a worker process. A task is given them as
+# its first argument when it runs in a thread, and None in a process.
+###
+_worker = None
+
+def _start_worker(grammar:bytes, packrat:object, engine:str, strict:bool) -> None:
+    global _worker
+    _worker = pickle.loads(grammar), packrat, engine, strict
+
+
+def _parse_batch(shared:tuple, texts:list) -> list:
+    parser, packrat, engine, strict = shared or _worker
+    return _parse_each(parser, texts, packrat, engine, strict)
+
+
+def _free_threaded() -> bool:
+    """
+    True on a Python whose threads run in parallel.
+    """
+    gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return gil_enabled is not None and not gil_enabled()
+
+
+def _pool_factory(parser:Parser, workers:int, backend:str, packrat:object, 
+    engine:str, strict:bool) -> tuple:
+    """
+    Check the options, and return a function that starts a pool of
+    workers, the first argument of its tasks, and the number of workers.
+    The grammar is pickled here, so that an unpicklable one is reported
+    before anything is parsed, but the pool is only started by _in_order,
+    so that a result that is never iterated leaves no workers behind.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError('workers must be positive.')
+    if isinstance(packrat, MemoTable):
+        raise ValueError('Each worker needs a memo table of its own; pass packrat=True or a size.')
+    backend = backend or ('thread' if _free_threaded() else 'process')
+
+    if backend == 'process':
+        grammar = pickle.dumps(parser)
+        start = lambda: concurrent.futures.ProcessPoolExecutor(workers, 
+            initializer=_start_worker, initargs=(grammar, packrat, engine, strict))
+        return start, None, workers
+    if backend == 'thread':
+        shared = parser, packrat, engine, strict
+        return lambda: concurrent.futures.ThreadPoolExecutor(workers), shared, workers
+    raise ValueError(f'Unknown backend {backend!r}.')
+
+
+def _in_order(start:Callable, workers:int, task:Callable, 
+    shared:tuple, arguments:Iterable) -> Iterable:
+    """
+    Start a pool, run task(shared, a) in it for each a of arguments, with
+    no more than two tasks per worker waiting, and yield the results in
+    order. The pool is shut down when the caller stops.
+    """
+    pending, limit = deque(), 2 * workers
+    pool = start()
+    try:
+        for a in arguments:
+            pending.append(pool.submit(task, shared, a))
+            if len(pending) >= limit:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _parse_many(parser:Parser, texts:Iterable, workers:int, chunksize:int,
+    backend:str, packrat:object, engine:str, strict:bool) -> Iterable:
+    """
+    The body of Parser.parse_many(). The arguments are checked, and the
+    grammar pickled, before anything is parsed.
+    """
+    if chunksize < 1:
+        raise ValueError('chunksize must be positive.')
+    start, shared, workers = _pool_factory(parser, workers, backend, packrat, engine, strict)
+    texts = iter(texts)
+    batches = iter(lambda: list(itertools.islice(texts, chunksize)), [])
+    return itertools.chain.from_iterable(_in_order(start, workers, _parse_batch, shared, batches))
+
+
+###
+# Parsing a file by ranges. Each range begins at the start of the file
+# or just after a record separator, and ends just after one or at the
+# end of the file, so that the parser sees whole records. A worker maps
+# only its range, from the page boundary below it, and a failure is
+# sent back with its positions in the whole file.
+###
+
+class _FileLines:
+    """
+    The line and column of an offset in a file, found by counting the
+    newlines before it when they are asked for. It stands in for the
+    LineIndex of a ParseError whose text is not held.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+
+
+    def location(self, index:int) -> tuple:
+        line, line_start, position = 0, 0, 0
+        with open(self.path, 'rb') as f:
+            while position < index:
+                block = f.read(min(1 << 20, index - position))
+                if not block:
+                    raise ValueError('Invalid index.')
+                n = block.count(b'\n')
+                if n:
+                    line += n
+                    line_start = position + block.rfind(b'\n') + 1
+                position += len(block)
+        return (line, index - line_start)
+
+
+def _record_ranges(path:str, separator:bytes, pieces:int) -> list:
+    """
+    Cut the file into about `pieces` ranges, (start, end), each of which
+    ends with a separator or at the end of the file.
+    """
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    bounds = [0]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for i in range(1, pieces):
+            target = max(size * i // pieces, bounds[-1])
+            found = m.find(separator, target)
+            if found < 0:
+                break
+            if found + len(separator) > bounds[-1]:
+                bounds.append(found + len(separator))
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _parse_range(shared:tuple, task:tuple) -> object:
+    """
+    The value of the parser over one range of the file, which it must
+    consume entirely, or the ParseError, with offsets in the file.
+    """
+    parser, packrat, engine, _ = shared or _worker
+    path, start, end = task
+    base = start - start % mmap.ALLOCATIONGRANULARITY
+    memo = MemoTable.from_option(packrat)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), end - base, 
+            offset=base, access=mmap.ACCESS_READ) as m:
+        with ParseContext(m, memo) as context:
+            result = (parser < eof())._run(m, start - base, engine)
+        if result.status:
+            return result.value
+        error = ParseError(result.expected, None, result.index).merge(context)
+    error.index += base
+    error.furthest += base
+    error.lines = _FileLines(path)
+    return error
+
+
+def parse_file_parallel(p:Parser, path:str, record_sep:Union[str, bytes]='\n', 
+    workers:int=None, chunk_bytes:int=1 << 24, backend:str=None, 
+    packrat:object=None, engine:str=None) -> Iterable:
+    """
+    Parse a large file of records in parallel. The file is cut into
+    ranges of about chunk_bytes, at least one per worker, each ending
+    just after a record_sep, and p is applied to each whole range in a
+    worker that maps it into memory. p must return a list, as
+    many(record) does, and the values in each of its lists are yielded
+    in file order; a value that is not a list raises a TypeError. 
+
+    The text that p sees is the mapped file, so its items are bytes, as
+    described under binary input. If a range does not parse, the values
+    of those before it are yielded and then its ParseError is raised;
+    the index and furthest of the error are offsets in the file, and its
+    message gives the line and column in the file.
+
+    backend -- 'process' or 'thread', as for Parser.parse_many().
+    """
+    separator = record_sep.encode('utf-8') if isinstance(record_sep, str) else bytes(record_sep)
+    if not separator:
+        raise ValueError('record_sep must not be empty.')
+    if chunk_bytes < 1:
+        raise ValueError('chunk_bytes must be positive.')
+    size = os.path.getsize(path)
+    start, shared, workers = _pool_factory(p, workers, backend, packrat, engine, True)
+    pieces = max(workers, size // chunk_bytes)
+    tasks = ((path, start, end) for start, end in _record_ranges(path, separator, pieces))
+
+    def records() -> Iterable:
+        for value in _in_order(start, workers, _parse_range, shared, tasks):
+            if isinstance(value, ParseError):
+                raise value
+            if not isinstance(value, list):
+                raise TypeError(f'parse_file_parallel() needs a parser of a list, such as '
+                    f'many(record), not one of {type(value).__name__}.')
+            yield from value
+
+    return records()
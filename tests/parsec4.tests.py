@@ -6,6 +6,8 @@ Test the basic functions of parsec.py.
 
 __author__ = 'He Tao, sighingnow@gmail.com'
 
+import json
+import pickle
 import random
 import unittest
 
@@ -449,5 +451,997 @@ class ParserGeneratorTest(unittest.TestCase):
         parser = xy
         self.assertEqual(parser.parse('xy'), 'success')
 
+class PackratTest(unittest.TestCase):
+    '''Test the packrat memo table.'''
+
+    def backtracking_parser(self) -> Parser:
+        calls = {'n': 0}
+
+        @Parser
+        def counted(text:str, index:int) -> Value:
+            calls['n'] += 1
+            return letter()(text, index)
+
+        word = many1(counted)
+        parser = (word + string('!')) ^ (word + string('?')) ^ word
+        return parser, calls
+
+    def test_same_results(self) -> None:
+        parser, _ = self.backtracking_parser()
+        for text in ('abc!', 'abc?', 'abc'):
+            self.assertEqual(parser.parse(text), parser.parse(text, packrat=True))
+        self.assertRaises(ParseError, parser.parse, '1', packrat=True)
+
+    def test_hits(self) -> None:
+        parser, calls = self.backtracking_parser()
+        parser.parse('abcdef')
+        plain, calls['n'] = calls['n'], 0
+
+        memo = MemoTable()
+        self.assertEqual(parser.parse('abcdef', packrat=memo), ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertLess(calls['n'], plain)
+        self.assertGreater(memo.hits, 0)
+        self.assertEqual(memo.stats()['misses'], memo.misses)
+
+    def test_bounded(self) -> None:
+        parser = many(letter() ^ digit())
+        memo = MemoTable(maxsize=16)
+        self.assertEqual(len(parser.parse('ab12' * 50, packrat=memo)), 200)
+        self.assertLessEqual(len(memo), 16)
+        self.assertGreater(memo.evictions, 0)
+
+        memo = MemoTable(policy='window', window=8)
+        self.assertEqual(len(parser.parse('ab12' * 50, packrat=memo)), 200)
+        self.assertLess(len(memo), 100)
+        self.assertGreater(memo.evictions, 0)
+
+    def test_no_context_leak(self) -> None:
+        string('x').parse('x', packrat=True)
+        self.assertIsNone(current_context())
+
+class LeftRecursionTest(unittest.TestCase):
+    '''Test left recursive rules.'''
+
+    def setUp(self) -> None:
+        num = regex(r'[0-9]+').parsecmap(int)
+
+        @left_recursive
+        def expr(expr:Parser) -> Parser:
+            return (expr + (string('-') >> num)).parsecmap(lambda t: t[0] - t[1]) ^ num
+
+        self.expr = expr
+
+    def test_left_associative(self) -> None:
+        self.assertEqual(self.expr.parse('7'), 7)
+        self.assertEqual(self.expr.parse('10-3-2'), 5)
+        self.assertEqual(self.expr.parse_partial('10-3-'), (7, '-'))
+        self.assertRaises(ParseError, self.expr.parse, '-1')
+
+    def test_packrat(self) -> None:
+        self.assertEqual(self.expr.parse('10-3-2', packrat=True), 5)
+        self.assertEqual(self.expr.parse('1' + '-0' * 3000, packrat=True), 1)
+
+    def test_define_later(self) -> None:
+        rule = LeftRecursive()
+        rule.define((rule << string('a')) ^ string('b'))
+        self.assertEqual(rule.parse('baaa'), 'b')
+        self.assertEqual(rule.parse_partial('baaac'), ('b', 'c'))
+
+class ForwardTest(unittest.TestCase):
+    '''Test rules declared before they are defined.'''
+
+    def test_ref(self) -> None:
+        expr = ref('expr')
+        atom = regex(r'[0-9]+') | (string('(') >> expr << string(')'))
+        expr.define(sepBy1(atom, string('+')))
+        self.assertEqual(expr.parse('1+(2+3)'), ['1', ['2', '3']])
+        self.assertEqual(expr.parse('((7))'), [[['7']]])
+        self.assertRaises(ParseError, expr.parse, '(1')
+
+    def test_undefined(self) -> None:
+        self.assertRaises(ValueError, ref('later').parse, 'x')
+
+    def test_fix_builds_once(self) -> None:
+        built = {'n': 0}
+
+        @fix
+        def bracketed(recur:Parser) -> Parser:
+            built['n'] += 1
+            return (string('(') >> recur << string(')')) | any_char()
+
+        self.assertEqual(bracketed.parse('(' * 20 + 'x' + ')' * 20), 'x')
+        self.assertEqual(built['n'], 1)
+        self.assertIsInstance(bracketed, Forward)
+
+class TrampolineTest(unittest.TestCase):
+    '''Test the non-recursive engine.'''
+
+    def test_deep_nesting(self) -> None:
+        expr = ref()
+        expr.define((string('(') >> expr << string(')')) | letter())
+        text = '(' * 20000 + 'x' + ')' * 20000
+        self.assertEqual(expr.parse(text, engine='trampoline'), 'x')
+        self.assertRaises(ParseError, expr.parse, text[:-1], engine='trampoline')
+
+    def test_long_chain(self) -> None:
+        parser = string('a')
+        for _ in range(5000):
+            parser = parser >> string('a')
+        self.assertEqual(parser.parse('a' * 5001, engine='trampoline'), 'a')
+
+    def test_same_results(self) -> None:
+        @generate
+        def pair() -> Parser:
+            left = yield letter()
+            yield string('=')
+            right = yield many1(digit())
+            return (left, ''.join(right))
+
+        parsers = [
+            sepBy(pair, string(',')),
+            endBy1(letter(), string(';')),
+            times(letter() + digit(), 1, 3) < eof(),
+            optional(string('x'), 'default') + (letter() / digit()),
+            mark(many(letter())) << string('!').result('bang'),
+            exclude(letter(), string('q')) ^ lookahead(digit()).parsecmap(int),
+            ]
+        texts = ['a=1,b=22', 'a;b;', 'a1b2', 'xy', 'abc!', 'q', '7', 'a1b', '']
+        for parser in parsers:
+            for text in texts:
+                try:
+                    expected = parser.parse_partial(text)
+                except ParseError as e:
+                    with self.assertRaises(ParseError) as err:
+                        parser.parse_partial(text, engine='trampoline')
+                    self.assertEqual((err.exception.index, err.exception.expected), (e.index, e.expected))
+                else:
+                    self.assertEqual(parser.parse_partial(text, engine='trampoline'), expected)
+
+    def test_unknown_engine(self) -> None:
+        self.assertRaises(ValueError, string('x').parse, 'x', engine='warp')
+
+class OptimizeTest(unittest.TestCase):
+    '''Test the flattening of operator trees.'''
+
+    def test_flat_choices(self) -> None:
+        a, b, c, d = string('a'), string('b'), string('c'), string('d')
+        parser = optimize(a ^ b ^ c ^ (d ^ a))
+        self.assertEqual(parser.kind, 'try_choices')
+        self.assertEqual(parser.args, (a, b, c, d, a))
+        self.assertEqual(parser.parse('c'), 'c')
+        self.assertEqual(optimize(a | b | c).kind, 'choices')
+
+        parser = (string('xy') | string('xz')) | string('w')
+        for text in ('xy', 'xz', 'w', 'q'):
+            try:
+                expected = parser.parse(text)
+            except ParseError as e:
+                with self.assertRaises(ParseError) as err:
+                    optimize(parser).parse(text)
+                self.assertEqual(err.exception.index, e.index)
+            else:
+                self.assertEqual(optimize(parser).parse(text), expected)
+
+    def test_flat_sequence(self) -> None:
+        a, b, c = string('a'), string('b'), string('c')
+        parser = optimize(a + b + c, fuse=False)
+        self.assertEqual(parser.kind, 'sequence')
+        self.assertEqual(len(parser.args[0]), 3)
+        self.assertEqual(parser.parse('abc'), (('a', 'b'), 'c'))
+        self.assertEqual(optimize(a >> (b + c) << a).parse('abca'), ('b', 'c'))
+
+    def test_same_failures(self) -> None:
+        a, b, c = string('a'), string('b'), string('c')
+        for parser in (a << (b << c), (a << b) << c, a >> b << c, a + (b << c)):
+            for text in ('abc', 'ab', 'a', 'ac', 'x'):
+                try:
+                    expected = parser.parse_partial(text)
+                except ParseError as e:
+                    with self.assertRaises(ParseError) as err:
+                        optimize(parser).parse_partial(text)
+                    self.assertEqual((err.exception.index, err.exception.expected), (e.index, e.expected))
+                else:
+                    self.assertEqual(optimize(parser).parse_partial(text), expected)
+
+    def test_recursive_rules(self) -> None:
+        expr = ref()
+        expr.define((string('(') >> expr << string(')')) ^ letter() ^ digit())
+        parser = optimize(expr)
+        self.assertIsInstance(parser, Forward)
+        self.assertEqual(parser.parse('((x))'), 'x')
+        self.assertEqual(parser.parse('((7))', engine='trampoline'), '7')
+
+class FuseTest(unittest.TestCase):
+    """
+    Regex fusion within optimized sequences.
+    """
+
+    def test_fused(self) -> None:
+        parser = optimize(string('x') >> regex(r'[0-9]+') << regex(r'\s*'))
+        self.assertEqual([p.kind for p in parser.args[0]], ['fused'])
+        self.assertEqual(parser.parse('x12  '), '12')
+        self.assertEqual(optimize(lexeme(IEEE754)).parse('3.14  '), '3.14')
+
+    def test_same_results(self) -> None:
+        a, b = string('a'), regex('b+')
+        for parser in (a >> b << a, a + b + one_of('xy'), (a << b) + regex('c', re.I),
+                regex('a*') >> string('a'), string('ab') >> b):
+            for text in ('abba', 'abbbx', 'abC', 'aaa', 'ab', 'a', 'x', ''):
+                try:
+                    expected = parser.parse_partial(text)
+                except ParseError as e:
+                    with self.assertRaises(ParseError) as err:
+                        optimize(parser).parse_partial(text)
+                    self.assertEqual((err.exception.index, err.exception.expected), (e.index, e.expected))
+                else:
+                    self.assertEqual(optimize(parser).parse_partial(text), expected)
+                    self.assertEqual(optimize(parser).parse_partial(text, engine='trampoline'), expected)
+
+    def test_not_fused(self) -> None:
+        parser = optimize(string('a') >> regex(r'^b') << regex(r'(c)\1'))
+        self.assertNotIn('fused', [p.kind for p in parser.args[0]])
+        self.assertEqual(optimize(string('a') >> regex('b'), fuse=False).kind, 'sequence')
+
+
+class KeywordsTest(unittest.TestCase):
+    """
+    The keywords() factory and parser_from_strings.
+    """
+
+    def test_longest_match(self) -> None:
+        parser = keywords(['in', 'int', 'if', 'for'])
+        self.assertEqual(parser.parse('int  '), 'int')
+        self.assertEqual(parser.parse_partial('inx'), ('in', 'x'))
+        self.assertEqual(parser.parse('for'), 'for')
+        self.assertRaises(ParseError, parser.parse, 'i')
+
+    def test_fold_and_cmap(self) -> None:
+        parser = parser_from_strings('exit quit', cmap='str.lower', fold=True)
+        self.assertEqual(parser.parse('QUIT '), 'quit')
+        self.assertEqual(keywords('1 10 100', cmap=int).parse('100'), 100)
+        self.assertRaises(ParseError, keywords('exit').parse, 'EXIT')
+
+    def test_special_characters(self) -> None:
+        parser = keywords('. .. ... a+b')
+        self.assertEqual(parser.parse('..'), '..')
+        self.assertEqual(parser.parse('a+b'), 'a+b')
+        self.assertRaises(ParseError, parser.parse, 'aab')
+
+    def test_bad_arguments(self) -> None:
+        self.assertRaises(ValueError, keywords, '')
+        self.assertRaises(ValueError, keywords, 'a', cmap='no_such_function')
+
+
+class DispatchTest(unittest.TestCase):
+    """
+    FIRST-set dispatch in the n-ary choice nodes.
+    """
+
+    def test_skips_alternatives(self) -> None:
+        b, f, n = string('b'), string('f'), string('n')
+        parser = choices(b, f, regex('[0-9]+'), n)
+        self.assertEqual(parser.alternatives('f', 0), (f, n))
+        self.assertEqual(parser.alternatives('n', 0), (n,))
+        self.assertEqual(parser.alternatives('x', 0), (n,))
+        self.assertEqual(parser.alternatives('', 0), (n,))
+        self.assertEqual(try_choices(b, regex(r'\s*'), n).alternatives('x', 0)[0].kind, 'regex')
+        self.assertEqual(parser.parse('7'), '7')
+        self.assertRaises(ParseError, parser.parse, 'x')
+
+    def test_same_results(self) -> None:
+        alternatives = (string('ab'), regex(r'[0-9]+'), regex(r'\s*'), 
+            string('ac'), lexeme(one_of('xyz')), regex('q', re.I), digit())
+        for parsers in (alternatives, alternatives[:2] + alternatives[3:5], alternatives[::-1]):
+            for combine in (lambda a, b: a | b, lambda a, b: a ^ b):
+                parser = parsers[0]
+                for p in parsers[1:]:
+                    parser = combine(parser, p)
+                for text in ('ab', 'ac', 'a', '12', ' 1', 'x ', 'Q', '', '-'):
+                    try:
+                        expected = parser.parse_partial(text)
+                    except ParseError as e:
+                        for engine in (None, 'trampoline'):
+                            with self.assertRaises(ParseError) as err:
+                                optimize(parser).parse_partial(text, engine=engine)
+                            self.assertEqual((err.exception.index, err.exception.expected), (e.index, e.expected))
+                    else:
+                        for engine in (None, 'trampoline'):
+                            self.assertEqual(optimize(parser).parse_partial(text, engine=engine), expected)
+
+    def test_binary(self) -> None:
+        import mmap, tempfile
+        abc = optimize(string('a') | string('b') | string('c'))
+        mixed = choices(one_of('xy'), digit(), string('z'), span_of(b'pq', 1), string('\xe9'))
+        with tempfile.TemporaryFile() as f:
+            f.write(b'b1q\xc3\xa9')
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for text in (b'b1q\xc3\xa9', bytearray(b'b1q\xc3\xa9'), memoryview(b'b1q\xc3\xa9'), m):
+                    self.assertEqual(abc.parse(text), b'b')
+                    self.assertEqual(mixed.parse(text[1:]), b'1')
+                    self.assertEqual(many(mixed).parse(text[1:]), [b'1', b'q', b'\xc3\xa9'])
+        self.assertEqual(mixed.parse([c for c in 'z1']), 'z')
+        self.assertEqual(mixed.parse('pq'), 'pq')
+
+
+class SpanTest(unittest.TestCase):
+    """
+    Run-scanning parsers, and many() over character classes.
+    """
+
+    def test_span_of(self) -> None:
+        self.assertEqual(span_of('ab').parse_partial('abbac'), ('abba', 'c'))
+        self.assertEqual(span_of('ab').parse(''), '')
+        self.assertEqual(span_of('.,', negate=True).parse_partial('xyz,w'), ('xyz', ',w'))
+        self.assertRaises(ParseError, span_of('ab', min_times=1).parse, 'c')
+        greek = span_of('\u03b1\u03b2')
+        self.assertEqual(greek.parse_partial('\u03b1\u03b2x'), ('\u03b1\u03b2', 'x'))
+        self.assertEqual(greek.parse_partial(b'ab'), (b'', b'ab'))
+        self.assertEqual(span_of('\u03b1\u03b2', negate=True).parse(b'ab'), b'ab')
+        self.assertRaises(ParseError, span_of('\u03b1\u03b2', min_times=1).parse, b'ab')
+
+    def test_span_while(self) -> None:
+        self.assertEqual(span_while(str.isalnum).parse_partial('abc12 x'), ('abc12', ' x'))
+        self.assertRaises(ParseError, span_while(str.isdigit, 1).parse, 'x')
+
+    def test_many_runs(self) -> None:
+        for parser in (space(), digit(), letter(), ascii_letter(), one_of('xy'), none_of(' ')):
+            for text in ('', ' \t1', '123a', 'abé9', 'xyxz', 'ab c'):
+                for repeat in (many, many1, lambda p: times(p, 2, 3)):
+                    fast = repeat(parser)
+                    self.assertTrue(fast.scans)
+                    slow = repeat(Parser(parser.fn))
+                    try:
+                        expected = slow.parse_partial(text)
+                    except ParseError as e:
+                        with self.assertRaises(ParseError) as err:
+                            fast.parse_partial(text)
+                        self.assertEqual((err.exception.index, err.exception.expected), (e.index, e.expected))
+                    else:
+                        self.assertEqual(fast.parse_partial(text), expected)
+                        self.assertEqual(fast.parse_partial(text, engine='trampoline'), expected)
+
+    def test_token_list(self) -> None:
+        self.assertEqual(many(one_of('ab')).parse_partial(['a', 'b', 'c']), (['a', 'b'], ['c']))
+
+
+class ValueTest(unittest.TestCase):
+    """
+    The Value result type.
+    """
+
+    def test_compatible(self) -> None:
+        v = Value.success(3, 'abc')
+        self.assertEqual(tuple(v), (True, 3, 'abc', None))
+        self.assertEqual((v.status, v.index, v.value, v.expected), (True, 3, 'abc', None))
+        self.assertEqual(v.update_index(5), Value(True, 5, 'abc', None))
+        self.assertIsInstance(v.update_index(5), Value)
+        self.assertTrue(v)
+        self.assertFalse(Value.failure(0, 'x'))
+        self.assertEqual(Value.failure(0, 'x')._replace(index=2), Value(False, 2, None, 'x'))
+
+    def test_no_dict(self) -> None:
+        self.assertFalse(hasattr(Value.success(0, None), '__dict__'))
+
+
+class StreamTest(unittest.TestCase):
+    """
+    Parsing from files and chunk iterators.
+    """
+    record = regex(r'[a-z]+') << string(';') << WHITESPACE
+
+    def test_file(self) -> None:
+        import io
+        text = ''.join(f"{'ab' * (i % 5)}x; " for i in range(5000))
+        values = list(self.record.parse_stream(io.StringIO(text), window=32, chunk_size=100))
+        self.assertEqual(values, many(self.record).parse(text))
+
+    def test_top_level_repetition(self) -> None:
+        text = ''.join(f"{'ab' * (i % 5)}x; " for i in range(2000))
+        chunks = [text[i:i + 7] for i in range(0, len(text), 7)]
+        self.assertEqual(list(many(self.record).parse_stream(chunks, window=32)), 
+            [many(self.record).parse(text)])
+
+    def test_chunks_split_tokens(self) -> None:
+        for engine in (None, 'trampoline'):
+            values = self.record.parse_stream(['ab', 'c;', ' d', ';'], window=4, engine=engine)
+            self.assertEqual(list(values), ['abc', 'd'])
+
+    def test_lazy(self) -> None:
+        import itertools
+        source = itertools.repeat('xy; ')
+        self.assertEqual(list(itertools.islice(self.record.parse_stream(source), 3)), ['xy'] * 3)
+
+    def test_eof(self) -> None:
+        parser = (string('a') << eof()) ^ string('b')
+        self.assertEqual(list(parser.parse_stream(['b', 'b', 'a'], window=1)), ['b', 'b', 'a'])
+
+    def test_failure(self) -> None:
+        import io
+        with self.assertRaises(ParseError) as err:
+            list(self.record.parse_stream(io.StringIO('ab; cd; e1;'), window=4, chunk_size=2))
+        self.assertEqual(err.exception.offset + err.exception.index, 9)
+
+    def test_long_run(self) -> None:
+        import io
+        line = many(digit()) << string('\n')
+        values = list(line.parse_stream(io.StringIO('1' * 10000 + '\n'), chunk_size=50))
+        self.assertEqual(len(values[0]), 10000)
+
+    def test_long_token(self) -> None:
+        import io
+        line = regex(r'[^\n]*\n')
+        with self.assertRaises(LookaheadError) as err:
+            list(line.parse_stream(io.StringIO('a' * 10000 + '\n'), chunk_size=50))
+        self.assertEqual(err.exception.offset + err.exception.index, 0)
+
+
+class IterParseTest(unittest.TestCase):
+    """
+    Lazy iteration over the matches of a record parser.
+    """
+    record = regex(r'[0-9]+').parsecmap(int) << WHITESPACE
+
+    def test_values(self) -> None:
+        text = ' '.join(str(i) for i in range(1000))
+        for engine in (None, 'trampoline'):
+            self.assertEqual(list(self.record.iter_parse(text, engine=engine)), list(range(1000)))
+        self.assertEqual(list(iterparse(self.record, 'x 1 2', 2)), [1, 2])
+
+    def test_early_stop(self) -> None:
+        seen = []
+        for value in self.record.iter_parse('1 2 3 x'):
+            seen.append(value)
+            if value == 2:
+                break
+        self.assertEqual(seen, [1, 2])
+        self.assertIsNone(current_context())
+
+    def test_failure(self) -> None:
+        values = self.record.iter_parse('1 2 x 3')
+        self.assertEqual((next(values), next(values)), (1, 2))
+        with self.assertRaises(ParseError) as err:
+            next(values)
+        self.assertEqual(err.exception.index, 4)
+
+
+class BinaryInputTest(unittest.TestCase):
+    """
+    Parsing bytes, bytearray, memoryview and mmap.
+    """
+    record = lexeme(regex(r'[a-z]+')) + lexeme(IEEE754).parsecmap(float) << string(';')
+    data = b'abc 1.5;  de 2;\nxyz -3e2;'
+    expected = [(b'abc', 1.5), (b'de', 2.0), (b'xyz', -300.0)]
+
+    def test_buffers(self) -> None:
+        parser = many(self.record << WHITESPACE)
+        for text in (self.data, bytearray(self.data), memoryview(self.data)):
+            self.assertEqual(parser.parse_strict(text), self.expected)
+
+    def test_mmap(self) -> None:
+        import mmap, tempfile
+        with tempfile.TemporaryFile() as f:
+            f.write(self.data)
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                self.assertEqual(list((self.record << WHITESPACE).iter_parse(m)), self.expected)
+
+    def test_primitives(self) -> None:
+        self.assertEqual(string(b'ab').parse(b'abc'), b'ab')
+        self.assertEqual(string('ab').parse(bytearray(b'abc')), b'ab')
+        self.assertEqual(one_of(b'xy').parse(b'y'), b'y')
+        self.assertEqual(none_of(';').parse(b'x'), b'x')
+        self.assertEqual(any_char().parse(b'q'), b'q')
+        self.assertEqual(many(digit()).parse(b'12a'), [b'1', b'2'])
+        self.assertEqual(many1(space()).parse(b' \tx'), [b' ', b'\t'])
+        self.assertEqual(many(letter()).parse(b'ab1'), [b'a', b'b'])
+        self.assertEqual(span_of(b'ab').parse(memoryview(b'abx')), b'ab')
+        self.assertEqual(regex(rb'\d+').parse(b'42'), b'42')
+        self.assertRaises(ParseError, regex(rb'\d+').parse, '42')
+
+    def test_literal_types(self) -> None:
+        self.assertEqual(string(b'ab').parse('abc'), 'ab')
+        self.assertEqual(string('\xe9').parse(b'\xc3\xa9'), b'\xc3\xa9')
+        self.assertEqual((string(b'x') | string('y')).parse('y'), 'y')
+        self.assertEqual(string(b'ab').parse(['a', 'b']), 'ab')
+        self.assertRaises(ParseError, string(b'ab').parse, 'xy')
+        self.assertRaises(ParseError, string(b'\xff').parse, '\xff')
+
+    def test_error_location(self) -> None:
+        with self.assertRaises(ParseError) as err:
+            self.record.parse(b'ab\n 1.5 x')
+        self.assertEqual(ParseError.loc_info(err.exception.text, err.exception.index), (1, 5))
+
+
+class FeederTest(unittest.TestCase):
+    """
+    Push parsing with feed() and close().
+    """
+    record = lexeme(regex(r'[a-z]+')) + lexeme(IEEE754).parsecmap(float) << string(';') << WHITESPACE
+
+    def test_chunks(self) -> None:
+        session = self.record.feeder(window=4)
+        values = []
+        for chunk in ('ab', 'c 1', '.5', '; de 2;', ' x', 'y 3', ';'):
+            values.extend(session.feed(chunk))
+            self.assertTrue(session.needs_input)
+        values.extend(session.close())
+        self.assertEqual(values, [('abc', 1.5), ('de', 2.0), ('xy', 3.0)])
+        self.assertFalse(session.needs_input)
+
+    def test_one_character_at_a_time(self) -> None:
+        text = ''.join(f"{'ab' * (i % 3 + 1)} {i}.5; " for i in range(200))
+        session = many(self.record).feeder(window=16)
+        fed = [v for c in text for v in session.feed(c)] + session.close()
+        self.assertEqual(fed, [many(self.record).parse(text)])
+
+    def test_long_match(self) -> None:
+        text = ''.join(f"{'ab' * (i % 3 + 1)} {i}.5; " for i in range(2000))
+        session = many(self.record).feeder(window=16)
+        lengths = set()
+        for c in text:
+            self.assertEqual(session.feed(c), [])
+            lengths.add(len(session.buffer))
+        self.assertEqual(session.close(), [many(self.record).parse(text)])
+        self.assertLess(len(lengths), 40)
+
+    def test_run_across_chunks(self) -> None:
+        text = '1' * 300 + '\n' + '2' * 70 + '\n'
+        chunks = [text[i:i + 50] for i in range(0, len(text), 50)]
+        for item in (digit(), letter() | digit()):
+            for packrat in (None, True):
+                session = (many(item) << string('\n')).feeder(packrat=packrat, window=16)
+                values = [v for c in chunks for v in session.feed(c)] + session.close()
+                self.assertEqual(values, [['1'] * 300, ['2'] * 70])
+        session = (span_of('12', 1) + regex('[^x]*x')).feeder(window=8)
+        values = [v for c in ('11', '2' * 30, '2\n\n', 'abx') for v in session.feed(c)]
+        self.assertEqual(values + session.close(), [('1' * 2 + '2' * 31, '\n\nabx')])
+
+    def test_generate(self) -> None:
+        @generate
+        def pair():
+            a = yield regex('[0-9]+')
+            yield string(',')
+            b = yield regex('[0-9]+')
+            return (a, b)
+        session = (pair << string(';')).feeder(window=2)
+        values = [v for c in '12,34;5,6;' for v in session.feed(c)] + session.close()
+        self.assertEqual(values, [('12', '34'), ('5', '6')])
+
+    def test_failure(self) -> None:
+        session = self.record.feeder(window=4)
+        self.assertEqual(session.feed('abc 1'), [])
+        with self.assertRaises(ParseError):
+            session.close()
+        session = self.record.feeder(window=4)
+        with self.assertRaises(ParseError):
+            session.feed('abc x; more text')
+            session.close()
+
+    def test_lookahead(self) -> None:
+        session = (regex(r'[a-z]*;')).feeder(window=4)
+        with self.assertRaises(LookaheadError):
+            session.feed('abcdefgh')
+            session.feed('ijklmnop; ')
+
+
+class ReparseTest(unittest.TestCase):
+    """
+    Incremental reparsing after edits.
+    """
+    stmt = lexeme(regex(r'[a-z]+')) + (lexeme(string('=')) >> lexeme(IEEE754)) << lexeme(string(';'))
+    doc = many(stmt)
+    text = ''.join(f"{'ab' * (i % 4 + 1)} = {i};\n" for i in range(300))
+
+    def check(self, previous:IncrementalParse, start:int, end:int, new_text:str) -> IncrementalParse:
+        result = self.doc.reparse(previous, start, end, new_text)
+        expected = previous.text[:start] + new_text + previous.text[end:]
+        self.assertEqual(result.text, expected)
+        self.assertEqual(result.value, self.doc.parse(expected))
+        return result
+
+    def test_edits(self) -> None:
+        handle = self.doc.parse_incremental(self.text)
+        self.assertEqual(handle.value, self.doc.parse(self.text))
+        pos = self.text.index('abab = 101;') + 7
+        handle = self.check(handle, pos, pos + 3, '77')
+        self.assertGreater(handle.table.hits, 250)
+        self.assertLess(handle.table.misses, 50)
+        handle = self.check(handle, 0, 0, 'zz = 5; ')
+        handle = self.check(handle, len(handle.text), len(handle.text), 'q = 1;')
+        handle = self.check(handle, 10, 40, '')
+        self.check(handle, 3, 4, 'abc')
+
+    def test_failed_parse(self) -> None:
+        handle = self.stmt.parse_incremental('abc = ;')
+        self.assertFalse(handle.ok)
+        self.assertRaises(ParseError, lambda: handle.value)
+        handle = self.stmt.reparse(handle, 6, 6, '3')
+        self.assertEqual(handle.value, ('abc', '3'))
+
+    def test_mark(self) -> None:
+        parser = many(lexeme(regex('[a-z]+').mark()))
+        handle = parser.parse_incremental('ab\ncd\nef')
+        handle = parser.reparse(handle, 0, 0, 'x\n')
+        self.assertEqual(handle.value, parser.parse('x\nab\ncd\nef'))
+
+
+class LineIndexTest(unittest.TestCase):
+    """
+    Line and column lookups.
+    """
+
+    def test_location(self) -> None:
+        text = 'ab\ncd\n\nefg'
+        lines = LineIndex(text)
+        for index in range(len(text) + 1):
+            self.assertEqual(lines.location(index), ParseError.loc_info(text, index))
+        self.assertEqual(lines.location(len(text)), (3, 3))
+        self.assertRaises(ValueError, lines.location, len(text) + 1)
+        self.assertEqual(LineIndex(b'a\nb').location(2), (1, 0))
+
+    def test_mark(self) -> None:
+        parser = many(lexeme(regex('[a-z]+').mark()))
+        expected = [((0, 0), 'ab', (0, 2)), ((0, 3), 'c', (0, 4)), ((1, 0), 'de', (1, 2))]
+        for engine in (None, 'trampoline'):
+            self.assertEqual(parser.parse('ab c\nde', engine=engine), expected)
+
+    def test_error_message(self) -> None:
+        with self.assertRaises(ParseError) as err:
+            (string('a') >> string('b')).parse('a\nc')
+        self.assertEqual(str(err.exception), 'expected: b at 0:1')
+        self.assertEqual(err.exception.loc(), '0:1')
+
+
+class ExpectedTest(unittest.TestCase):
+
+    def test_lazy(self) -> None:
+        v = (string('a') << string('b'))('ac', 0)
+        self.assertIsInstance(v.expected, Expected)
+        self.assertIsNone(v.expected.text)
+        self.assertEqual(v.expected, 'ends with b')
+        self.assertEqual(str(v.expected), 'ends with b')
+
+    def test_rendered_by_parse_error(self) -> None:
+        for engine in (None, 'trampoline'):
+            with self.assertRaises(ParseError) as err:
+                (string('a') / string('b')).parse('ab', engine=engine)
+            self.assertEqual(err.exception.expected, 'should not be "b"')
+            self.assertIs(type(err.exception.expected), str)
+
+    def test_deep_nesting(self) -> None:
+        e = 'x'
+        for _ in range(5000):
+            e = Expected('ends with {}', e)
+        self.assertTrue(str(e).startswith('ends with ends with '))
+        self.assertEqual(len(str(e)), 5000 * len('ends with ') + 1)
+
+
+class FurthestFailureTest(unittest.TestCase):
+
+    item = regex('[0-9]+') | (string('(') >> regex('[0-9]+') << string(')'))
+    parser = sepBy(item, string(',')) < eof()
+
+    def test_furthest(self) -> None:
+        for engine in (None, 'trampoline'):
+            with self.assertRaises(ParseError) as err:
+                self.parser.parse('1,x', engine=engine)
+            e = err.exception
+            self.assertEqual((e.index, e.expected), (1, 'ends with EOF'))
+            self.assertEqual(e.furthest, 2)
+            self.assertEqual(e.expectations, ['[0-9]+', '('])
+            self.assertEqual(str(e), 'expected: [0-9]+ or ( at 0:2')
+
+    def test_same_index(self) -> None:
+        with self.assertRaises(ParseError) as err:
+            (string('a') | string('b') | string('a')).parse('c')
+        self.assertEqual(err.exception.expectations, ['a', 'b'])
+        self.assertEqual(err.exception.furthest, 0)
+
+    def test_nested(self) -> None:
+        with self.assertRaises(ParseError) as err:
+            self.parser.parse('1,(2', packrat=True)
+        self.assertEqual(str(err.exception), 'expected: ends with ) at 0:4')
+
+    def test_desc(self) -> None:
+        number = regex('[0-9]+').desc('number')
+        parser = (string('-') | number) + (string(';') | string('.'))
+        for engine in (None, 'trampoline'):
+            with self.assertRaises(ParseError) as err:
+                parser.parse('x', engine=engine)
+            self.assertEqual(err.exception.expectations, ['-', 'number'])
+            with self.assertRaises(ParseError) as err:
+                parser.parse('1,', engine=engine)
+            self.assertEqual(err.exception.expectations, [';', '.'])
+
+    def test_iter_parse(self) -> None:
+        record = optional(string('x')) >> regex('[0-9]') << string(';')
+        with self.assertRaises(ParseError) as err:
+            list(record.iter_parse('1;y'))
+        self.assertEqual(err.exception.expectations, ['x', '[0-9]'])
+
+    def test_optimized(self) -> None:
+        word = regex('[a-z]+')
+        value = (string('-') | regex('[0-9]+').desc('number') | string('(') | word) ^ string('[')
+        parser = sepBy(value << (string(';') ^ string('.')), string(',')) < eof()
+        for text in ('x', '1,', '1;,x', 'ab;,(', '?', '-;2', '1;.'):
+            with self.assertRaises(ParseError) as plain:
+                parser.parse(text)
+            for engine in (None, 'trampoline'):
+                with self.assertRaises(ParseError) as optimized:
+                    optimize(parser).parse(text, engine=engine)
+                self.assertEqual(str(optimized.exception), str(plain.exception))
+                self.assertEqual(optimized.exception.expectations, plain.exception.expectations)
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_counts(self) -> None:
+        a = string('a')
+        parser = (a + string('b')) ^ (a + string('c')).desc('a then c')
+        with Profiler() as profile:
+            parser.parse('ac')
+        rows = {row['label']: row for row in profile.report()}
+        self.assertEqual((rows["string 'a'"]['calls'], rows["string 'a'"]['retries']), (2, 1))
+        self.assertEqual(rows["string 'b'"]['failures'], 1)
+        self.assertEqual(rows['joint']['backtracks'], 1)
+        self.assertEqual(rows['a then c']['successes'], 1)
+        for row in rows.values():
+            self.assertLessEqual(row['own'], row['cumulative'] + 1e-9)
+
+    def test_scope(self) -> None:
+        parser = many(string('xy'))
+        with Profiler() as outer:
+            with Profiler() as inner:
+                parser.parse('xyxy')
+            parser.parse('xy', packrat=True)
+        parser.parse('xyxyxy')
+        self.assertEqual(sum(row['calls'] for row in inner.report()), 3)
+        self.assertEqual(sum(row['calls'] for row in outer.report()), 2)
+        self.assertIsNone(current_context())
+
+    def test_report(self) -> None:
+        with Profiler() as profile:
+            sepBy(regex('[0-9]'), string(',')).parse('1,2,3')
+        rows = profile.report(sort='calls')
+        self.assertEqual([row['calls'] for row in rows], sorted((row['calls'] for row in rows), reverse=True))
+        self.assertEqual(json.loads(profile.to_json('calls', 1)), rows[:1])
+        self.assertRaises(ValueError, profile.report, 'speed')
+        self.assertIn("regex '[0-9]'", str(profile))
+
+
+class TelemetryTest(unittest.TestCase):
+
+    parser = sepBy(regex('[0-9]+'), string(','))
+
+    def test_counts(self) -> None:
+        with Telemetry(rate=1.0, worst=2, sample_chars=3) as telemetry:
+            for text in ('1', '1,2', '1,2,3,4,5,6,7,8', 'x'):
+                self.parser.parse(text)
+            self.assertRaises(ParseError, self.parser.parse_strict, '1,x')
+        self.parser.parse('1')
+        [entry] = telemetry.snapshot()['parsers']
+        self.assertEqual(entry['parser'], 'separated')
+        self.assertEqual((entry['successes'], entry['failures']), (4, 1))
+        self.assertEqual(sum(entry['latency_us'].values()), 5)
+        self.assertEqual(entry['size'], {'2': 2, '4': 2, '16': 1})
+        self.assertEqual(len(entry['slowest']), 2)
+        for slow in entry['slowest']:
+            self.assertLessEqual(len(slow['sample']), 3)
+
+    def test_export(self) -> None:
+        snapshots = []
+        with Telemetry(rate=1.0, sink=snapshots.append, interval=0.0) as telemetry:
+            self.parser.parse('12')
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(json.loads(json.dumps(snapshots[0])), telemetry.snapshot())
+        self.assertRaises(ValueError, Telemetry, 2.0)
+
+    def test_unsampled(self) -> None:
+        with Telemetry(rate=0.0) as telemetry:
+            self.parser.parse('1,2')
+        self.assertEqual(telemetry.snapshot()['parsers'], [])
+
+
+class SampleTest(unittest.TestCase):
+
+    @staticmethod
+    def grammar() -> Parser:
+        token = lambda s: lexeme(string(s))
+        @fix
+        def value(value:Parser) -> Parser:
+            items = token('[') >> sepBy(value, token(',')) << token(']')
+            return items | lexeme(regex(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?')) | token('nil') ^ token('null')
+        return value
+
+    def test_valid(self) -> None:
+        for parser in (self.grammar(), optimize(self.grammar()), 
+                sepBy1(IPv4_ADDR, one_of(',;')), many(span_of('xy', 1) + optional(string('z')))):
+            for seed in range(5):
+                text = sample(parser, 200, seed=seed)
+                self.assertGreaterEqual(len(text), 200)
+                parser.parse_strict(text)
+
+    def test_negated_class(self) -> None:
+        parser = many1(regex(r'[^a-c\d]x'))
+        for seed in range(5):
+            parser.parse_strict(sample(parser, 100, seed=seed))
+
+    def test_seed(self) -> None:
+        self.assertEqual(sample(self.grammar(), 100, seed=7), sample(self.grammar(), 100, seed=7))
+
+    def test_near_miss(self) -> None:
+        for seed in range(5):
+            text = sample(self.grammar(), 50, seed=seed, near_miss=True)
+            self.assertRaises(ParseError, self.grammar().parse_strict, text)
+
+    def test_unsampled(self) -> None:
+        self.assertRaises(ValueError, sample, quoted)
+        self.assertRaises(ValueError, sample, string('a').bind(lambda a: string(a)))
+
+
+@generate
+def pair() -> tuple:
+    key = yield regex('[a-z]+')
+    yield string('=')
+    value = yield regex('[0-9]+').parsecmap(int)
+    raise EndOfGenerator((key, value))
+
+
+@Parser
+def upper(text:str, index:int) -> Value:
+    if index < len(text) and text[index].isupper():
+        return Value.success(index + 1, text[index])
+    return Value.failure(index, 'an upper case letter')
+
+
+class PickleTest(unittest.TestCase):
+
+    @staticmethod
+    def grammar() -> Parser:
+        token = lambda s: lexeme(string(s))
+        @fix
+        def value(value:Parser) -> Parser:
+            items = token('[') >> sepBy(value, token(',')) << token(']')
+            return items | lexeme(pair) | lexeme(span_while(str.isdigit, 1)) | lexeme(upper)
+        return value
+
+    @staticmethod
+    def subtraction() -> Parser:
+        @left_recursive
+        def expr(expr:Parser) -> Parser:
+            return (expr + (string('-') >> regex('[0-9]+'))) ^ regex('[0-9]+')
+        return expr
+
+    def test_round_trip(self) -> None:
+        text = '[a=1, [B, 22], [], x=3]'
+        for parser in (self.grammar(), optimize(self.grammar()), quoted, keywords('if else', 'str.upper')):
+            copy = pickle.loads(pickle.dumps(parser))
+            self.assertIsNot(copy, parser)
+            self.assertEqual(fingerprint(copy), fingerprint(parser))
+        copy = pickle.loads(pickle.dumps(self.grammar()))
+        self.assertEqual(copy.parse(text), self.grammar().parse(text))
+        self.assertEqual(copy.parse(text, engine='trampoline'), self.grammar().parse(text))
+        copy = pickle.loads(pickle.dumps(self.subtraction()))
+        self.assertEqual(copy.parse('9-8-7'), self.subtraction().parse('9-8-7'))
+
+    def test_shared(self) -> None:
+        word = regex('[a-z]+')
+        copy = pickle.loads(pickle.dumps(word + word))
+        self.assertIs(copy.args[0], copy.args[1])
+        rule = ref('nested')
+        rule.define(string('(') >> optional(rule) << string(')'))
+        copy = pickle.loads(pickle.dumps(rule))
+        self.assertIs(copy.body.args[0].args[1].args[0], copy)
+        self.assertEqual(copy.parse_partial('((()))x'), rule.parse_partial('((()))x'))
+
+    def test_unpicklable(self) -> None:
+        self.assertRaises((pickle.PicklingError, AttributeError), pickle.dumps, 
+            string('a').parsecmap(lambda a: a * 2))
+
+    def test_fingerprint(self) -> None:
+        self.assertEqual(fingerprint(self.grammar()), fingerprint(self.grammar()))
+        self.assertNotEqual(fingerprint(string('a')), fingerprint(string('b')))
+        self.assertNotEqual(fingerprint(many(string('a'))), fingerprint(many1(string('a'))))
+        a = string('a')
+        self.assertNotEqual(fingerprint(a + a), fingerprint(a + string('a')))
+
+
+class ParseManyTest(unittest.TestCase):
+
+    record = sepBy1(regex('[0-9]+').parsecmap(int), string(','))
+    texts = ['1,2,3', 'x', '4,5', '6,', '7'] * 3
+
+    def check(self, results:list) -> None:
+        self.assertEqual(len(results), len(self.texts))
+        for text, result in zip(self.texts, results):
+            if text in ('x', '6,'):
+                self.assertIsInstance(result, ParseError)
+                self.assertEqual(result.text, text)
+            else:
+                self.assertEqual(result, [int(n) for n in text.split(',')])
+
+    def test_process(self) -> None:
+        self.check(list(self.record.parse_many(self.texts, workers=2, chunksize=3, 
+            backend='process', strict=True)))
+
+    def test_thread(self) -> None:
+        self.check(list(self.record.parse_many(iter(self.texts), workers=2, chunksize=4, 
+            backend='thread', strict=True)))
+        self.assertEqual(list(self.record.parse_many([], backend='thread')), [])
+
+    def test_arguments(self) -> None:
+        self.assertRaises((pickle.PicklingError, AttributeError), self.record.parsecmap(
+            lambda v: v).parse_many, self.texts, backend='process')
+        self.assertRaises(ValueError, self.record.parse_many, self.texts, backend='fibre')
+        self.assertRaises(ValueError, self.record.parse_many, self.texts, workers=0)
+
+    def test_error_pickle(self) -> None:
+        try:
+            self.record.parse_strict('1,2,x')
+        except ParseError as e:
+            copy = pickle.loads(pickle.dumps(e))
+            self.assertEqual(str(copy), str(e))
+            self.assertEqual(copy.expectations, e.expectations)
+            self.assertEqual((copy.text, copy.index, copy.furthest), (e.text, e.index, e.furthest))
+
+
+class ParseFileParallelTest(unittest.TestCase):
+
+    record = sepBy1(regex(b'[0-9]+').parsecmap(int), string(',')) << string('\n')
+    lines = [','.join(str(i * 7 + j) for j in range(i % 5 + 1)) for i in range(800)]
+
+    def setUp(self) -> None:
+        import os, tempfile
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def write(self, lines:list) -> bytes:
+        data = ('\n'.join(lines) + '\n').encode()
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        return data
+
+    def test_in_order(self) -> None:
+        self.write(self.lines)
+        expected = [[int(n) for n in line.split(',')] for line in self.lines]
+        for backend in ('process', 'thread'):
+            self.assertEqual(list(parse_file_parallel(many(self.record), self.path, 
+                workers=2, chunk_bytes=1000, backend=backend)), expected)
+
+    def test_error_position(self) -> None:
+        lines = list(self.lines)
+        lines[613] = '12,x4'
+        data = self.write(lines)
+        records = []
+        with self.assertRaises(ParseError) as raised:
+            for r in parse_file_parallel(many(self.record), self.path, workers=2, chunk_bytes=1000):
+                records.append(r)
+        e = raised.exception
+        self.assertEqual(e.furthest, data.index(b'\n12,x4') + 4)
+        self.assertTrue(str(e).endswith('at 613:3'))
+        self.assertLessEqual(len(records), 613)
+        self.assertEqual(records[:10], [[int(n) for n in line.split(',')] for line in lines[:10]])
+
+    def test_separator(self) -> None:
+        with open(self.path, 'wb') as f:
+            f.write(b'a;bb;;ccc;' * 50)
+        word = regex(b'[a-z]*') << string(';')
+        self.assertEqual(list(parse_file_parallel(many(word), self.path, ';', workers=3, 
+            chunk_bytes=7)), [b'a', b'bb', b'', b'ccc'] * 50)
+        open(self.path, 'wb').close()
+        self.assertEqual(list(parse_file_parallel(many(word), self.path, ';', workers=2)), [])
+
+    def test_not_a_list(self) -> None:
+        import threading
+        self.write(self.lines)
+        before = threading.active_count()
+        records = parse_file_parallel(regex(b'[^x]*'), self.path, workers=2, backend='thread')
+        self.assertEqual(threading.active_count(), before)
+        with self.assertRaises(TypeError):
+            next(records)
+
+
 if __name__ == '__main__':
     unittest.main()